@@ -0,0 +1,227 @@
+"""Offline benchmark of doc_search indexing and querying.
+
+Inventories of the requested sizes are generated deterministically, so runs on the
+same machine are comparable. Results are printed and written as JSON:
+
+    pdm run python -m bench.doc_search --sizes 10000 100000 500000 -o bench.json
+
+Only the search service is loaded, without the bot, and everything it writes is kept
+in a temporary directory.
+"""
+
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import sys
+import tempfile
+import time
+import types
+import zlib
+from collections.abc import Awaitable, Callable
+from pathlib import Path
+
+import kayaku
+
+INVENTORY_URL = "https://bench.invalid/objects.inv"
+HEADER = b"""# Sphinx inventory version 2
+# Project: bench
+# Version: 1.0
+# The remainder of this file is compressed using zlib.
+"""
+SYLLABLES = [
+    "as", "ync", "io", "ga", "ther", "loop", "str", "eam", "que", "ue", "ev",
+    "ent", "han", "dle", "fu", "ture", "cli", "ent", "ser", "ver", "re", "quest",
+    "con", "fig", "par", "se", "ren", "der", "ca", "che", "in", "dex", "to",
+    "ken", "buf", "fer", "rea", "der", "wri", "ter", "sock", "et", "path", "lib",
+]  # fmt: skip
+ROLES = ["function", "class", "method", "attribute", "module", "exception", "data"]
+
+
+def words(rng: random.Random, count: int) -> list[str]:
+    # dict keeps insertion order, unlike set iteration which depends on PYTHONHASHSEED
+    generated = (
+        "".join(rng.choices(SYLLABLES, k=rng.randint(1, 3))) for _ in range(count * 2)
+    )
+    return list(dict.fromkeys(generated))[:count]
+
+
+def generate(size: int, seed: int = 0) -> tuple[bytes, list[str]]:
+    """A compressed objects.inv of `size` py-domain objects, and their names."""
+    rng = random.Random(seed)
+    packages, modules, classes = words(rng, 20), words(rng, 200), words(rng, 2000)
+    members = words(rng, 5000)
+    names: list[str] = []
+    lines: list[bytes] = []
+    for i in range(size):
+        parts = [rng.choice(packages), rng.choice(modules)]
+        if rng.random() < 0.7:
+            parts.append(rng.choice(classes).capitalize())
+        parts.append(f"{rng.choice(members)}_{i}" if i % 3 else rng.choice(members))
+        name = ".".join(parts)
+        names.append(name)
+        role = rng.choice(ROLES)
+        lines.append(f"{name} py:{role} 1 {parts[0]}/{parts[1]}.html#$ -\n".encode())
+    return HEADER + zlib.compress(b"".join(lines)), names
+
+
+def typo(word: str, rng: random.Random) -> str:
+    if len(word) < 4:
+        return word + "x"
+    i = rng.randrange(1, len(word) - 2)
+    return word[:i] + word[i + 1] + word[i] + word[i + 2 :]
+
+
+def query_sets(names: list[str], count: int, seed: int = 1) -> dict[str, list[str]]:
+    rng = random.Random(seed)
+    picked = [rng.choice(names).split(".") for _ in range(count)]
+    return {
+        "exact": [".".join(parts) for parts in picked],
+        "multi_term": [f"{parts[1]} {parts[-1]}" for parts in picked],
+        "prefix": [
+            ".".join([*parts[:-1], parts[-1][: max(2, len(parts[-1]) // 2)]])
+            for parts in picked
+        ],
+        "fuzzy": [typo(parts[-1].partition("_")[0], rng) for parts in picked],
+    }
+
+
+def percentiles(samples: list[float]) -> dict[str, float]:
+    cuts = statistics.quantiles(samples, n=100, method="inclusive")
+    return {
+        "p50_ms": cuts[49] * 1000,
+        "p95_ms": cuts[94] * 1000,
+        "p99_ms": cuts[98] * 1000,
+        "mean_ms": statistics.fmean(samples) * 1000,
+    }
+
+
+async def timed(func: Callable[[], Awaitable[object]]) -> float:
+    start = time.perf_counter()
+    await func()
+    return time.perf_counter() - start
+
+
+async def run_size(size: int, args: argparse.Namespace, workdir: Path) -> dict:
+    from modules.doc_search.service import (
+        FetchedInventory,
+        QueryCache,
+        ReadPool,
+        SearchInterface,
+        SphinxSearchConfig,
+        SphinxSearchService,
+    )
+
+    data, names = generate(size)
+    service = SphinxSearchService(workdir / f"objects-{size}.db")
+    service.config = SphinxSearchConfig(
+        inventory_urls=[INVENTORY_URL], read_connections=args.concurrency
+    )
+    service.prepare_index()
+    start = time.perf_counter()
+    service.build_index({INVENTORY_URL: FetchedInventory(data)})
+    ingest = time.perf_counter() - start
+    with sqlite3.connect(service.db) as conn:
+        (objects,) = conn.execute("SELECT COUNT(*) FROM objects;").fetchone()
+    result: dict = {
+        "size": size,
+        "objects": objects,
+        "inventory_bytes": len(data),
+        "ingest_s": ingest,
+        "ingest_rows_per_s": objects / ingest,
+        "db_bytes": service.db.stat().st_size,
+        "queries": {},
+    }
+
+    service.query_cache = QueryCache(0)  # Measure the database, not the cache
+    service.readers = ReadPool(service.db, args.concurrency)
+    await service.readers.open()
+    interface = SearchInterface(service)
+    try:
+        sets = query_sets(names, args.queries)
+        for kind, queries in sets.items():
+            samples = [
+                await timed(lambda: interface.search(q, args.total)) for q in queries
+            ]
+            result["queries"][kind] = percentiles(samples)
+
+        mixed = [q for queries in sets.values() for q in queries]
+        slots = asyncio.Semaphore(args.concurrency)
+
+        async def run(query: str) -> None:
+            async with slots:
+                await interface.search(query, args.total)
+
+        elapsed = await timed(lambda: asyncio.gather(*map(run, mixed)))
+        result["throughput"] = {
+            "concurrency": args.concurrency,
+            "queries": len(mixed),
+            "qps": len(mixed) / elapsed,
+        }
+    finally:
+        await service.readers.close()
+    return result
+
+
+def load_service(workdir: Path) -> None:
+    """Import `modules.doc_search.service` alone, skipping the saya module around it."""
+    kayaku.initialize({"{**}": f"{workdir.as_posix()}/config/{{**}}"})
+    package = types.ModuleType("modules.doc_search")
+    package.__path__ = [str(Path(__file__).parent.parent / "modules" / "doc_search")]
+    sys.modules["modules.doc_search"] = package
+    importlib.import_module("modules.doc_search.service")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--sizes", type=int, nargs="+", default=[10_000, 100_000, 500_000]
+    )
+    parser.add_argument("--queries", type=int, default=200, help="per query kind")
+    parser.add_argument("--total", type=int, default=5, help="results per query")
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("-o", "--output", type=Path, default=Path("bench.json"))
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        workdir = Path(tmp)
+        load_service(workdir)
+        results = []
+        for size in args.sizes:
+            res = asyncio.run(run_size(size, args, workdir))
+            results.append(res)
+            print(
+                f"{size:>8} objects: ingest {res['ingest_s']:.2f}s"
+                f" ({res['ingest_rows_per_s']:.0f} rows/s),"
+                f" db {res['db_bytes'] / 2**20:.1f} MiB,"
+                f" {res['throughput']['qps']:.0f} qps"
+            )
+            for kind, stats in res["queries"].items():
+                print(
+                    f"{kind:>18}: p50 {stats['p50_ms']:.2f}ms"
+                    f" p95 {stats['p95_ms']:.2f}ms p99 {stats['p99_ms']:.2f}ms"
+                )
+
+    report = {
+        "meta": {
+            "timestamp": time.time(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "queries": args.queries,
+            "total": args.total,
+        },
+        "results": results,
+    }
+    args.output.write_text(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+# CPU-bound image work, kept free of kayaku/launart state so it can run in worker processes
+from io import BytesIO
+from math import sqrt
+
+from PIL import Image
+
+WEBP_MAX_SIDE = 16383
+JPEG_MAX_SIDE = 65500
+
+
+def encode(img: Image.Image, fmt: str, quality: int, flat_colors: int) -> bytes:
+    buf = BytesIO()
+    if fmt == "png":
+        if img.getcolors(flat_colors) is not None:
+            # Flat UI screenshots survive a 256 colors palette with hardly any loss
+            img = img.quantize(256, method=Image.Quantize.FASTOCTREE)
+        img.save(buf, "PNG", optimize=True)
+    elif fmt == "jpeg":
+        img.convert("RGB").save(
+            buf, "JPEG", quality=quality, optimize=True, progressive=True
+        )
+    elif fmt == "webp":
+        img.save(buf, "WEBP", quality=quality, method=4)
+    else:
+        raise ValueError(f"Unsupported image format: {fmt}")
+    return buf.getvalue()
+
+
+def compress(
+    data: bytes,
+    max_bytes: int,
+    max_pixels: int,
+    formats: list[str],
+    quality: int,
+    flat_colors: int,
+) -> bytes:
+    """Re-encode `data` into the smallest of `formats`, downscaled to fit `max_bytes`."""
+    img = Image.open(BytesIO(data))
+    img = img.convert("RGBA" if img.mode in ("RGBA", "LA", "P") else "RGB")
+    if img.mode == "RGBA" and img.getextrema()[3][0] == 255:
+        img = img.convert("RGB")  # Fully opaque, drop the alpha channel
+    best: bytes | None = data
+    if (pixels := img.width * img.height) > max_pixels:
+        img = scale(img, sqrt(max_pixels / pixels))
+        best = None
+
+    for _ in range(8):
+        for fmt in formats:
+            if fmt == "webp" and max(img.size) > WEBP_MAX_SIDE:
+                continue
+            if fmt == "jpeg" and max(img.size) > JPEG_MAX_SIDE:
+                continue
+            encoded = encode(img, fmt, quality, flat_colors)
+            if best is None or len(encoded) < len(best):
+                best = encoded
+        if best is not None and len(best) <= max_bytes:
+            break
+        img = scale(img, 0.75)
+    assert best is not None, "No usable image format"
+    return best
+
+
+def scale(img: Image.Image, factor: float) -> Image.Image:
+    size = (max(1, int(img.width * factor)), max(1, int(img.height * factor)))
+    return img.resize(size, Image.Resampling.LANCZOS)
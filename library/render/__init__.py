@@ -0,0 +1,43 @@
+from contextlib import AsyncExitStack, asynccontextmanager
+from typing import AsyncGenerator
+
+from launart import Launart
+from playwright.async_api import Page
+
+from .cache import RenderCache, get_cache
+from .config import (
+    VIEWPORT,
+    ImageConfig,
+    InterceptConfig,
+    RenderCacheConfig,
+    RenderConfig,
+    RenderSchedulerConfig,
+)
+from .flight import SingleFlight
+from .intercept import DEFAULT_PROFILE, BlockProfile, get_asset_cache, intercept
+from .pool import PageLeaseTimeout, PagePool, PagePoolService
+from .postprocess import postprocess
+from .scheduler import Priority, RenderOverloaded, RenderScheduler, get_scheduler
+from .tabs import TabCache
+from .tiles import element_tiles
+
+
+@asynccontextmanager
+async def get_page(
+    url: str | None = None,
+    priority: Priority = Priority.NORMAL,
+    profile: BlockProfile | None = DEFAULT_PROFILE,
+) -> AsyncGenerator[Page, None]:
+    """Lease a browser page, scheduled under the host of `url` when it is given.
+
+    Requests of the page are filtered by `profile`, pass `None` to disable interception.
+    """
+    async with AsyncExitStack() as stack:
+        if url is not None:
+            await stack.enter_async_context(get_scheduler().slot(url, priority))
+        page = await stack.enter_async_context(
+            Launart.current().get_interface(PagePool).lease()
+        )
+        if profile is not None:
+            stack.push_async_callback(await intercept(page, profile))
+        yield page
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import time
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable
+
+import msgspec
+from kayaku import create
+from loguru import logger
+
+from library.storage import dir
+
+from .config import VIEWPORT, RenderCacheConfig, RenderConfig
+from .flight import SingleFlight
+
+
+class CacheEntry(msgspec.Struct):
+    size: int
+    expires: float
+
+
+class RenderCache:
+    """Rendered images stored on disk, indexed in memory with TTL and LRU eviction."""
+
+    root: Path
+    index: OrderedDict[str, CacheEntry]
+    flight: SingleFlight[bytes]
+    hits: int
+    misses: int
+
+    def __init__(self, root: Path, config: RenderCacheConfig) -> None:
+        self.root = root
+        self.config = config
+        self.index_file = root / "index.msgpack"
+        self.index = OrderedDict()
+        self.flight = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        if self.index_file.exists():
+            try:
+                self.index.update(
+                    msgspec.msgpack.decode(
+                        self.index_file.read_bytes(), type=dict[str, CacheEntry]
+                    )
+                )
+            except msgspec.DecodeError:
+                logger.warning("Render cache index is corrupted, starting afresh")
+        for key in [k for k in self.index if not self.path(k).exists()]:
+            del self.index[key]
+        for tmp in root.glob("*.tmp"):  # Left by writes cut off by a restart
+            tmp.unlink(missing_ok=True)
+        self.size = sum(e.size for e in self.index.values())
+
+    @staticmethod
+    def key(
+        url: str,
+        selector: str,
+        viewport: dict[str, int] = VIEWPORT,
+        color_scheme: str | None = None,
+    ) -> str:
+        color_scheme = color_scheme or create(RenderConfig).color_scheme
+        ident = msgspec.json.encode([url, selector, viewport, color_scheme])
+        return hashlib.sha256(ident).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.root / f"{key}.bin"
+
+    def save_index(self) -> None:
+        tmp = self.index_file.with_suffix(".tmp")
+        tmp.write_bytes(msgspec.msgpack.encode(dict(self.index)))
+        tmp.replace(self.index_file)
+
+    def write(self, key: str, data: bytes) -> None:
+        # Overlapping writes use their own temp file, readers never see a partial one
+        tmp = self.root / f"{key}.{uuid.uuid4().hex}.tmp"
+        tmp.write_bytes(data)
+        tmp.replace(self.path(key))
+
+    def remove(self, key: str) -> None:
+        if entry := self.index.pop(key, None):
+            self.size -= entry.size
+            self.path(key).unlink(missing_ok=True)
+
+    async def get(self, key: str) -> bytes | None:
+        entry = self.index.get(key)
+        if entry is None or entry.expires < time.time():
+            if entry is not None:
+                self.remove(key)
+            self.misses += 1
+            return None
+        try:
+            data = await asyncio.to_thread(self.path(key).read_bytes)
+        except OSError:
+            self.remove(key)
+            self.misses += 1
+            return None
+        self.index.move_to_end(key)
+        self.hits += 1
+        return data
+
+    async def put(self, source: str, key: str, data: bytes) -> None:
+        ttl = self.config.ttl.get(source, self.config.default_ttl)
+        if ttl <= 0 or len(data) > self.config.size_budget:
+            return
+        await asyncio.to_thread(self.write, key, data)
+        # No await from here on, so overlapping puts of a key are counted once
+        if old := self.index.pop(key, None):
+            self.size -= old.size
+        self.index[key] = CacheEntry(len(data), time.time() + ttl)
+        self.size += len(data)
+        while self.size > self.config.size_budget and self.index:
+            self.remove(next(iter(self.index)))
+        self.save_index()
+
+    async def fetch(
+        self,
+        source: str,
+        key: str,
+        render: Callable[[], Awaitable[bytes]],
+    ) -> bytes:
+        async def fill() -> bytes:
+            if (data := await self.get(key)) is not None:
+                return data
+            data = await render()
+            await self.put(source, key, data)
+            return data
+
+        return await self.flight.run(key, fill)
+
+    @property
+    def stats(self) -> dict[str, int | list[dict[str, str | int]]]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "entries": len(self.index),
+            "size": self.size,
+            **self.flight.stats,
+        }
+
+
+_cache: RenderCache | None = None
+
+
+def get_cache() -> RenderCache:
+    global _cache
+    if _cache is None:
+        _cache = RenderCache(dir("render_cache"), create(RenderCacheConfig))
+    return _cache
@@ -0,0 +1,82 @@
+from dataclasses import field
+from typing import Literal
+
+from kayaku import config
+
+VIEWPORT = {"height": 800, "width": 1000}
+
+
+@config("render.playwright")
+class RenderConfig:
+    color_scheme: Literal["dark", "light"] = "dark"
+    pool_size: int = 4
+    """Max number of live browser pages, all of them are warmed up on startup."""
+    lease_timeout: float = 60
+    """Seconds to wait for a free page before giving up."""
+    max_page_uses: int = 50
+    """Recycle a page after it has been leased this many times."""
+    health_check_timeout: float = 5
+    """Seconds a page has to answer a health probe before it is recycled."""
+
+
+@config("render.cache")
+class RenderCacheConfig:
+    size_budget: int = 256 * 1024 * 1024
+    """Max total bytes of cached renders on disk, least recently used ones are evicted first."""
+    ttl: dict[str, float] = field(
+        default_factory=lambda: {
+            "pep": 86400,
+            "github": 300,
+            "doc_search": 86400,
+            "opengraph": 7 * 86400,
+        }
+    )
+    """Seconds a cached render stays fresh, by source."""
+    default_ttl: float = 600
+    """Seconds a cached render stays fresh when its source is not listed in `ttl`."""
+
+
+@config("render.scheduler")
+class RenderSchedulerConfig:
+    max_concurrency: int = 4
+    """Max number of renders running at the same time."""
+    host_limits: dict[str, int] = field(
+        default_factory=lambda: {"github.com": 2, "peps.python.org": 2}
+    )
+    """Max number of renders running at the same time, by host."""
+    default_host_limit: int = 2
+    """Per-host limit for hosts not listed in `host_limits`."""
+    max_queue_depth: int = 32
+    """New renders are rejected while this many renders are waiting."""
+    shed_wait: float = 20
+    """Low priority renders are rejected while the oldest waiting render has waited this many seconds."""
+    max_wait: float = 60
+    """Seconds a render may wait in the queue before it is dropped."""
+
+
+@config("render.intercept")
+class InterceptConfig:
+    blocking: bool = True
+    """Whether to abort requests matched by the block profile of a renderer."""
+    asset_cache: bool = True
+    """Whether to share fetched stylesheets, scripts and fonts across pages."""
+    asset_cache_size: int = 64 * 1024 * 1024
+    """Max total bytes of cached static assets."""
+    asset_ttl: float = 3600
+    """Max seconds a static asset is served from cache."""
+
+
+@config("render.image")
+class ImageConfig:
+    max_bytes: int = 2 * 1024 * 1024
+    """Rendered images are downscaled until they fit in this many bytes."""
+    max_pixels: int = 16_000_000
+    """Rendered images are downscaled to at most this many pixels."""
+    formats: list[str] = field(default_factory=lambda: ["png", "jpeg"])
+    """Candidate formats, the smallest encoding wins. Could be png, jpeg, webp."""
+    quality: int = 85
+    """Quality of lossy formats."""
+    flat_colors: int = 4096
+    """Images with at most this many colors are palette-quantized as PNG."""
+    workers: int = 2
+    """Number of worker processes for image processing."""
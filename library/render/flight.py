@@ -0,0 +1,57 @@
+import asyncio
+from collections import OrderedDict
+from typing import Awaitable, Callable, Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+# Per-key counts are kept for this many keys, the least recently called are forgotten
+TRACKED_KEYS = 256
+# Keys reported by `stats`, most coalesced first
+TOP_KEYS = 10
+
+
+class SingleFlight(Generic[T]):
+    """Let concurrent calls with the same key share one in-flight task."""
+
+    inflight: dict[Hashable, "asyncio.Future[T]"]
+    keys: OrderedDict[Hashable, list[int]]  # key -> [calls, coalesced]
+
+    def __init__(self) -> None:
+        self.inflight = {}
+        self.calls = 0
+        self.coalesced = 0
+        self.keys = OrderedDict()
+
+    def count(self, key: Hashable, coalesced: bool) -> None:
+        self.calls += 1
+        self.coalesced += coalesced
+        counts = self.keys.setdefault(key, [0, 0])
+        counts[0] += 1
+        counts[1] += coalesced
+        self.keys.move_to_end(key)
+        while len(self.keys) > TRACKED_KEYS:
+            self.keys.popitem(last=False)
+
+    async def run(self, key: Hashable, func: Callable[[], Awaitable[T]]) -> T:
+        if (fut := self.inflight.get(key)) is None:
+            self.count(key, False)
+            fut = self.inflight[key] = asyncio.ensure_future(func())
+            fut.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            self.count(key, True)
+        # Cancelling one awaiter must not cancel the render shared with the others
+        return await asyncio.shield(fut)
+
+    @property
+    def stats(self) -> dict[str, int | list[dict[str, str | int]]]:
+        top = sorted(self.keys.items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            "inflight": len(self.inflight),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "top_coalesced": [
+                {"key": str(key), "calls": calls, "coalesced": coalesced}
+                for key, (calls, coalesced) in top[:TOP_KEYS]
+                if coalesced
+            ],
+        }
@@ -0,0 +1,172 @@
+import contextlib
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Awaitable, Callable
+
+from kayaku import create
+from loguru import logger
+from playwright.async_api import Page, Request, Route
+
+from .config import InterceptConfig
+
+TRACKERS = (
+    r"google-analytics\.com",
+    r"googletagmanager\.com",
+    r"doubleclick\.net",
+    r"plausible\.io",
+    r"scorecardresearch\.com",
+    r"readthedocs\.org/api/v2/(footer_html|analytics)",
+    r"ethicalads\.io",
+    r"carbonads\.(com|net)",
+)
+CACHEABLE_TYPES = {"stylesheet", "script", "font"}
+# Bodies are stored decoded, so these no longer describe them
+STRIPPED_HEADERS = {"content-encoding", "content-length", "transfer-encoding"}
+
+
+@dataclass(frozen=True)
+class BlockProfile:
+    """Requests to abort by resource type or URL regex, unless matched by `allow`."""
+
+    resource_types: frozenset[str] = frozenset()
+    url_patterns: tuple[str, ...] = ()
+    allow: tuple[str, ...] = ()
+
+    def extend(
+        self,
+        resource_types: frozenset[str] = frozenset(),
+        url_patterns: tuple[str, ...] = (),
+        allow: tuple[str, ...] = (),
+    ) -> "BlockProfile":
+        return BlockProfile(
+            self.resource_types | resource_types,
+            self.url_patterns + url_patterns,
+            self.allow + allow,
+        )
+
+    def blocks(self, request: Request) -> bool:
+        url = request.url
+        if any(re.search(p, url) for p in self.allow):
+            return False
+        return request.resource_type in self.resource_types or any(
+            re.search(p, url) for p in self.url_patterns
+        )
+
+
+DEFAULT_PROFILE = BlockProfile(
+    frozenset({"media", "websocket", "eventsource", "manifest", "texttrack"}),
+    TRACKERS,
+)
+
+
+@dataclass
+class Asset:
+    status: int
+    headers: dict[str, str]
+    body: bytes
+    expires: float
+
+
+class AssetCache:
+    """In-memory LRU of static assets, shared by every pooled page.
+
+    Routing a page disables the browser's own HTTP cache, so this takes its place.
+    """
+
+    assets: OrderedDict[str, Asset]
+
+    def __init__(self, config: InterceptConfig) -> None:
+        self.config = config
+        self.assets = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, url: str) -> Asset | None:
+        asset = self.assets.get(url)
+        if asset is None or asset.expires < time.time():
+            if asset is not None:
+                self.size -= len(self.assets.pop(url).body)
+            self.misses += 1
+            return None
+        self.assets.move_to_end(url)
+        self.hits += 1
+        return asset
+
+    def ttl(self, headers: dict[str, str]) -> float:
+        cache_control = headers.get("cache-control", "")
+        if "no-store" in cache_control or "private" in cache_control:
+            return 0
+        if m := re.search(r"max-age=(\d+)", cache_control):
+            return min(float(m[1]), self.config.asset_ttl)
+        return self.config.asset_ttl
+
+    def put(self, url: str, status: int, headers: dict[str, str], body: bytes) -> None:
+        if (ttl := self.ttl(headers)) <= 0 or len(body) > self.config.asset_cache_size:
+            return
+        if old := self.assets.pop(url, None):
+            self.size -= len(old.body)
+        self.assets[url] = Asset(status, headers, body, time.time() + ttl)
+        self.size += len(body)
+        while self.size > self.config.asset_cache_size:
+            _, evicted = self.assets.popitem(last=False)
+            self.size -= len(evicted.body)
+
+
+_assets: AssetCache | None = None
+
+
+def get_asset_cache() -> AssetCache:
+    global _assets
+    if _assets is None:
+        _assets = AssetCache(create(InterceptConfig))
+    return _assets
+
+
+def route_handler(
+    profile: BlockProfile,
+) -> Callable[[Route, Request], Awaitable[None]]:
+    config = create(InterceptConfig)
+    assets = get_asset_cache()
+
+    async def handle(route: Route, request: Request) -> None:
+        if config.blocking and profile.blocks(request):
+            return await route.abort("blockedbyclient")
+        if (
+            not config.asset_cache
+            or request.method != "GET"
+            or request.resource_type not in CACHEABLE_TYPES
+        ):
+            return await route.continue_()
+        if asset := assets.get(request.url):
+            return await route.fulfill(
+                status=asset.status, headers=asset.headers, body=asset.body
+            )
+        try:
+            resp = await route.fetch()
+            body = await resp.body()
+        except Exception as e:
+            logger.debug(f"Failed to fetch {request.url}: {e!r}")
+            return await route.abort()
+        if resp.status == 200:
+            headers = {
+                k: v for k, v in resp.headers.items() if k not in STRIPPED_HEADERS
+            }
+            assets.put(request.url, resp.status, headers, body)
+        await route.fulfill(response=resp, body=body)
+
+    return handle
+
+
+async def intercept(page: Page, profile: BlockProfile) -> Callable[[], Awaitable[None]]:
+    """Route requests of `page` through `profile`, returns a callback undoing it."""
+    handler = route_handler(profile)
+    await page.route("**/*", handler)
+
+    async def undo() -> None:
+        with contextlib.suppress(Exception):
+            await page.unroute("**/*", handler)
+
+    return undo
@@ -0,0 +1,233 @@
+import asyncio
+import contextlib
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Callable
+
+from graiax.playwright import PlaywrightBrowser
+from kayaku import create
+from launart import ExportInterface, Launart, Service
+from loguru import logger
+from playwright.async_api import Page
+
+from .cache import get_cache
+from .config import VIEWPORT, RenderConfig
+from .postprocess import shutdown_executor, start_executor
+from .scheduler import get_scheduler
+
+# Report render queue, pool and cache figures this often, in seconds
+REPORT_INTERVAL = 600
+
+
+class PageLeaseTimeout(TimeoutError):
+    pass
+
+
+class PooledPage:
+    page: Page
+    uses: int
+    crashed: bool
+
+    def __init__(self, page: Page) -> None:
+        self.page = page
+        self.uses = 0
+        self.crashed = False
+        page.once("crash", lambda _: setattr(self, "crashed", True))
+
+
+class PagePool(ExportInterface):
+    """A bounded pool of pre-warmed browser pages."""
+
+    service: "PagePoolService"
+
+    def __init__(self, service: "PagePoolService", browser: PlaywrightBrowser) -> None:
+        self.service = service
+        self.browser = browser
+        self.config = create(RenderConfig)
+        self.idle: deque[PooledPage] = deque()
+        self.leased: set[PooledPage] = set()
+        self.slots = asyncio.Semaphore(self.config.pool_size)
+        self.recycled: int = 0
+        # Called in turn while no page is free, until one gives back a page it holds
+        self.reclaimers: list[Callable[[], bool]] = []
+
+    async def new_page(self) -> PooledPage:
+        return PooledPage(
+            await self.browser.new_page(
+                viewport=VIEWPORT,  # type: ignore
+                color_scheme=self.config.color_scheme,
+            )
+        )
+
+    async def warm(self) -> None:
+        self.idle.extend(
+            await asyncio.gather(
+                *(self.new_page() for _ in range(self.config.pool_size))
+            )
+        )
+        logger.info(f"Warmed up {len(self.idle)} browser pages")
+
+    async def healthy(self, entry: PooledPage) -> bool:
+        if entry.crashed or entry.page.is_closed():
+            return False
+        if entry.uses >= self.config.max_page_uses:
+            return False
+        try:
+            await asyncio.wait_for(
+                entry.page.evaluate("1"), self.config.health_check_timeout
+            )
+        except Exception:
+            return False
+        return True
+
+    async def discard(self, entry: PooledPage) -> None:
+        self.recycled += 1
+        with contextlib.suppress(Exception):
+            await entry.page.context.close()
+
+    async def reset(self, entry: PooledPage) -> None:
+        page = entry.page
+        # Close popups and other pages leaked into this page's context
+        for other in page.context.pages:
+            if other is not page:
+                await other.close()
+        await page.goto("about:blank")
+        await page.context.clear_cookies()
+        await page.context.clear_permissions()
+        await page.set_viewport_size(VIEWPORT)  # type: ignore
+
+    async def checkout(self) -> PooledPage:
+        while self.idle:
+            entry = self.idle.popleft()
+            if await self.healthy(entry):
+                return entry
+            logger.debug("Recycling unhealthy browser page")
+            await self.discard(entry)
+        return await self.new_page()
+
+    async def checkin(self, entry: PooledPage) -> None:
+        if not entry.crashed:
+            try:
+                await asyncio.wait_for(
+                    self.reset(entry), self.config.health_check_timeout
+                )
+            except Exception as e:
+                logger.debug(f"Failed to reset browser page: {e!r}")
+            else:
+                self.idle.append(entry)
+                return
+        await self.discard(entry)
+
+    def reclaim(self) -> None:
+        for reclaim in self.reclaimers:
+            if reclaim():
+                return
+
+    async def acquire(self) -> PooledPage:
+        if self.slots.locked():
+            self.reclaim()
+        try:
+            await asyncio.wait_for(self.slots.acquire(), self.config.lease_timeout)
+        except asyncio.TimeoutError:
+            raise PageLeaseTimeout(
+                f"No browser page available in {self.config.lease_timeout}s"
+            ) from None
+        try:
+            entry = await self.checkout()
+        except BaseException:
+            self.slots.release()
+            raise
+        entry.uses += 1
+        self.leased.add(entry)
+        try:
+            await entry.page.emulate_media(color_scheme=self.config.color_scheme)
+        except BaseException:
+            await self.release(entry)
+            raise
+        return entry
+
+    async def release(self, entry: PooledPage) -> None:
+        self.leased.discard(entry)
+        try:
+            await self.checkin(entry)
+        finally:
+            self.slots.release()
+
+    @asynccontextmanager
+    async def lease(self) -> AsyncGenerator[Page, None]:
+        entry = await self.acquire()
+        try:
+            yield entry.page
+        finally:
+            await self.release(entry)
+
+    @property
+    def stats(self) -> dict[str, int]:
+        return {
+            "size": self.config.pool_size,
+            "leased": len(self.leased),
+            "idle": len(self.idle),
+            "recycled": self.recycled,
+        }
+
+    async def close(self) -> None:
+        while self.idle:
+            await self.discard(self.idle.popleft())
+        for entry in list(self.leased):
+            await self.discard(entry)
+
+
+class PagePoolService(Service):
+    id = "render.page_pool"
+    supported_interface_types = {PagePool}
+    pool: PagePool
+    report_task: asyncio.Task | None = None
+
+    @property
+    def stages(self):
+        return {"preparing", "cleanup"}
+
+    @property
+    def required(self):
+        return {"web.render/playwright"}
+
+    def get_interface(self, _: type[PagePool]) -> PagePool:
+        return self.pool
+
+    async def launch(self, manager: Launart):
+        async with self.stage("preparing"):
+            start_executor()
+            self.pool = PagePool(self, manager.get_interface(PlaywrightBrowser))
+            await self.pool.warm()
+            self.report_task = asyncio.create_task(self.report())
+
+        async with self.stage("cleanup"):
+            if self.report_task:
+                self.report_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await self.report_task
+            await self.pool.close()
+            await asyncio.to_thread(shutdown_executor)
+
+    async def report(self) -> None:
+        while True:
+            await asyncio.sleep(REPORT_INTERVAL)
+            pool = self.pool.stats
+            queue = get_scheduler().stats
+            cache = get_cache().stats
+            logger.info(
+                f"Render pool: {pool['leased']}/{pool['size']} pages leased,"
+                f" {pool['recycled']} recycled"
+            )
+            logger.info(
+                f"Render queue: {queue['queued']} queued, {queue['running']} running,"
+                f" wait avg {queue['avg_wait']:.2f}s max {queue['max_wait']:.2f}s,"
+                f" {queue['rejected']} rejected"
+            )
+            logger.info(
+                f"Render cache: {cache['hits']} hits, {cache['misses']} misses,"
+                f" {cache['entries']} entries of {cache['size'] / 2**20:.1f} MiB,"
+                f" {cache['coalesced']}/{cache['calls']} renders coalesced"
+            )
+            if cache["top_coalesced"]:
+                logger.debug(f"Most coalesced renders: {cache['top_coalesced']}")
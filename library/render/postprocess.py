@@ -0,0 +1,50 @@
+import asyncio
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+from kayaku import create
+
+from library.image import compress
+
+from .config import ImageConfig
+
+_executor: ProcessPoolExecutor | None = None
+
+
+def start_executor() -> None:
+    global _executor
+    # Workers are spawned rather than forked from this threaded process
+    _executor = ProcessPoolExecutor(
+        create(ImageConfig).workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(cancel_futures=True)
+        _executor = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    if _executor is None:
+        raise RuntimeError("Image workers are not running, is the page pool up?")
+    return _executor
+
+
+async def postprocess(data: bytes) -> bytes:
+    """Shrink a screenshot for sending, off the event loop."""
+    config = create(ImageConfig)
+    return await asyncio.get_running_loop().run_in_executor(
+        get_executor(),
+        partial(
+            compress,
+            data,
+            config.max_bytes,
+            config.max_pixels,
+            list(config.formats),
+            config.quality,
+            config.flat_colors,
+        ),
+    )
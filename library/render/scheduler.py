@@ -0,0 +1,145 @@
+import asyncio
+import itertools
+import time
+from collections import Counter
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, field
+from enum import IntEnum
+from typing import AsyncGenerator
+
+from kayaku import create
+from yarl import URL
+
+from .config import RenderSchedulerConfig
+
+
+class Priority(IntEnum):
+    HIGH = 0
+    NORMAL = 1
+    LOW = 2
+
+
+class RenderOverloaded(Exception):
+    pass
+
+
+@dataclass(order=True)
+class Job:
+    priority: int
+    seq: int
+    host: str = field(compare=False)
+    enqueued: float = field(compare=False)
+    ready: "asyncio.Future[None]" = field(compare=False)
+
+
+class RenderScheduler:
+    """Run render jobs by priority under global and per-host concurrency limits."""
+
+    pending: list[Job]
+    running: int
+    host_running: Counter[str]
+
+    def __init__(self, config: RenderSchedulerConfig) -> None:
+        self.config = config
+        self.pending = []
+        self.running = 0
+        self.host_running = Counter()
+        self.seq = itertools.count()
+        self.rejected = 0
+        self.avg_wait = 0.0
+        self.max_wait_seen = 0.0
+
+    def host_limit(self, host: str) -> int:
+        return self.config.host_limits.get(host, self.config.default_host_limit)
+
+    @property
+    def current_wait(self) -> float:
+        if not self.pending:
+            return 0.0
+        return time.monotonic() - min(job.enqueued for job in self.pending)
+
+    def dispatch(self) -> None:
+        for job in sorted(self.pending):
+            if self.running >= self.config.max_concurrency:
+                return
+            if job.ready.done():  # Waiter gave up
+                self.pending.remove(job)
+                continue
+            if self.host_running[job.host] >= self.host_limit(job.host):
+                continue
+            self.pending.remove(job)
+            self.running += 1
+            self.host_running[job.host] += 1
+            job.ready.set_result(None)
+
+    def release(self, job: Job) -> None:
+        self.running -= 1
+        self.host_running[job.host] -= 1
+        if not self.host_running[job.host]:
+            del self.host_running[job.host]
+        self.dispatch()
+
+    def admit(self, priority: Priority) -> None:
+        if len(self.pending) >= self.config.max_queue_depth:
+            self.rejected += 1
+            raise RenderOverloaded(f"{len(self.pending)} renders are already queued")
+        if priority >= Priority.LOW and self.current_wait > self.config.shed_wait:
+            self.rejected += 1
+            raise RenderOverloaded(f"Render queue is lagging {self.current_wait:.1f}s")
+
+    @asynccontextmanager
+    async def slot(
+        self, url: str, priority: Priority = Priority.NORMAL
+    ) -> AsyncGenerator[None, None]:
+        self.admit(priority)
+        job = Job(
+            priority,
+            next(self.seq),
+            URL(url).host or "",
+            time.monotonic(),
+            asyncio.get_running_loop().create_future(),
+        )
+        self.pending.append(job)
+        self.dispatch()
+        try:
+            await asyncio.wait_for(job.ready, self.config.max_wait)
+        except BaseException as e:
+            if job in self.pending:
+                self.pending.remove(job)
+            if job.ready.done() and not job.ready.cancelled():
+                self.release(job)  # Granted right before we bailed out
+            if isinstance(e, asyncio.TimeoutError):
+                self.rejected += 1
+                raise RenderOverloaded(
+                    f"Render waited in queue for over {self.config.max_wait}s"
+                ) from None
+            raise
+        wait = time.monotonic() - job.enqueued
+        self.avg_wait = self.avg_wait * 0.9 + wait * 0.1
+        self.max_wait_seen = max(self.max_wait_seen, wait)
+        try:
+            yield
+        finally:
+            self.release(job)
+
+    @property
+    def stats(self) -> dict[str, int | float | dict[str, int]]:
+        return {
+            "queued": len(self.pending),
+            "running": self.running,
+            "hosts": dict(self.host_running),
+            "current_wait": self.current_wait,
+            "avg_wait": self.avg_wait,
+            "max_wait": self.max_wait_seen,
+            "rejected": self.rejected,
+        }
+
+
+_scheduler: RenderScheduler | None = None
+
+
+def get_scheduler() -> RenderScheduler:
+    global _scheduler
+    if _scheduler is None:
+        _scheduler = RenderScheduler(create(RenderSchedulerConfig))
+    return _scheduler
@@ -0,0 +1,153 @@
+import asyncio
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator, Awaitable, Callable
+
+from kayaku import create
+from launart import Launart
+from loguru import logger
+from playwright.async_api import Page
+
+from .config import RenderConfig
+from .flight import SingleFlight
+from .intercept import BlockProfile, intercept
+from .pool import PagePool, PooledPage
+from .scheduler import Priority, get_scheduler
+
+
+class Tab:
+    entry: PooledPage
+    undo_intercept: Callable[[], Awaitable[None]]
+    last_used: float
+    closed: bool
+
+    def __init__(
+        self, entry: PooledPage, undo_intercept: Callable[[], Awaitable[None]]
+    ) -> None:
+        self.entry = entry
+        self.undo_intercept = undo_intercept
+        self.last_used = time.monotonic()
+        self.lock = asyncio.Lock()
+        self.closed = False
+
+    @property
+    def alive(self) -> bool:
+        return not self.entry.crashed and not self.entry.page.is_closed()
+
+
+class TabCache:
+    """Keep recently loaded pages open, so revisiting them skips navigation.
+
+    Tabs are leased from the `PagePool` and hold their slot until evicted, or until
+    the pool runs out of pages and reclaims the least recently used idle one.
+    """
+
+    tabs: OrderedDict[str, Tab]
+
+    def __init__(self, max_tabs: int, idle_timeout: float) -> None:
+        pool_size = create(RenderConfig).pool_size
+        if max_tabs >= pool_size:
+            # Renders outside the cache would have no page left to lease
+            logger.error(
+                f"Cannot keep {max_tabs} tabs open with {pool_size} pooled pages,"
+                f" keeping {pool_size - 1}"
+            )
+            max_tabs = max(pool_size - 1, 0)
+        self.max_tabs = max_tabs
+        self.idle_timeout = idle_timeout
+        self.tabs = OrderedDict()
+        self.loading: SingleFlight[Tab] = SingleFlight()
+        self.sweeper: asyncio.Task | None = None
+        self.closing: set[asyncio.Task] = set()
+        self.hits = 0
+        self.misses = 0
+
+    @property
+    def pool(self) -> PagePool:
+        return Launart.current().get_interface(PagePool)
+
+    async def load(self, url: str, profile: BlockProfile, priority: Priority) -> Tab:
+        pool = self.pool
+        if self.reclaim not in pool.reclaimers:
+            pool.reclaimers.append(self.reclaim)
+        async with get_scheduler().slot(url, priority):
+            entry = await pool.acquire()
+            try:
+                tab = Tab(entry, await intercept(entry.page, profile))
+                await entry.page.goto(url, wait_until="networkidle")
+            except BaseException:
+                await pool.release(entry)
+                raise
+        return tab
+
+    async def close(self, tab: Tab) -> None:
+        async with tab.lock:
+            tab.closed = True
+            await tab.undo_intercept()
+            await self.pool.release(tab.entry)
+
+    def evict(self, url: str) -> None:
+        if tab := self.tabs.pop(url, None):
+            task = asyncio.create_task(self.close(tab))
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
+
+    def reclaim(self) -> bool:
+        """Evict the least recently used tab not in use, for a render out of pages."""
+        for url, tab in self.tabs.items():
+            if not tab.lock.locked():
+                logger.debug(f"Closing idle tab {url} for a waiting render")
+                self.evict(url)
+                return True
+        return False
+
+    async def sweep(self) -> None:
+        while self.tabs:
+            await asyncio.sleep(self.idle_timeout / 2)
+            deadline = time.monotonic() - self.idle_timeout
+            for url in [u for u, t in self.tabs.items() if t.last_used < deadline]:
+                logger.debug(f"Closing idle tab {url}")
+                self.evict(url)
+        self.sweeper = None
+
+    async def get(self, url: str, profile: BlockProfile, priority: Priority) -> Tab:
+        tab = self.tabs.get(url)
+        if tab is not None and tab.alive:
+            self.hits += 1
+            self.tabs.move_to_end(url)
+            return tab
+        self.misses += 1
+        self.evict(url)
+
+        async def load() -> Tab:
+            # Stored by the shared load itself, so the leased page stays owned by the
+            # cache even when every caller waiting for it has been cancelled
+            tab = await self.load(url, profile, priority)
+            self.evict(url)  # A dead tab stored meanwhile would never be released
+            self.tabs[url] = tab
+            while len(self.tabs) > self.max_tabs:
+                self.evict(next(iter(self.tabs)))
+            if self.sweeper is None:
+                self.sweeper = asyncio.create_task(self.sweep())
+            return tab
+
+        return await self.loading.run(url, load)
+
+    @asynccontextmanager
+    async def open(
+        self,
+        url: str,
+        profile: BlockProfile,
+        priority: Priority = Priority.NORMAL,
+    ) -> AsyncGenerator[Page, None]:
+        """Lease the tab showing `url`, loading it first if it is not kept alive."""
+        while True:
+            tab = await self.get(url, profile, priority)
+            async with tab.lock:
+                if tab.closed or not tab.alive:
+                    continue  # Evicted or crashed while we were waiting
+                tab.last_used = time.monotonic()
+                yield tab.entry.page
+                tab.last_used = time.monotonic()
+                return
@@ -0,0 +1,27 @@
+from typing import AsyncGenerator
+
+from playwright.async_api import ElementHandle, Page
+
+
+async def element_tiles(
+    page: Page, elem: ElementHandle, tile_height: int
+) -> AsyncGenerator[bytes, None]:
+    """Screenshot a tall element as consecutive clips of at most `tile_height` pixels.
+
+    Only one tile is captured at a time, so peak memory is bounded by the tile size
+    instead of the element size.
+    """
+    await elem.scroll_into_view_if_needed()
+    box = await elem.bounding_box()
+    if box is None:
+        return
+    scroll_x, scroll_y = await page.evaluate("() => [window.scrollX, window.scrollY]")
+    x, y = box["x"] + scroll_x, box["y"] + scroll_y
+    top = 0.0
+    while top < box["height"]:
+        height = min(tile_height, box["height"] - top)
+        yield await page.screenshot(
+            clip={"x": x, "y": y + top, "width": box["width"], "height": height},
+            full_page=True,  # Makes clip relative to the document
+        )
+        top += height
@@ -45,12 +45,15 @@ if __name__ == "__main__":
         }
     )
     atexit.register(kayaku.save_all)
+    from library.render import PagePoolService
+
     saya = creart.it(Saya)
     bcc = creart.it(Broadcast)
     inject_bypass_listener(bcc)
     bcc.prelude_dispatchers.append(LaunartDispatcher())
     manager = Launart()
     manager.add_launchable(PlaywrightService())
+    manager.add_launchable(PagePoolService())
     manager.add_launchable(AiohttpClientService())
     saya.install_behaviours(
         LaunartBehaviour(manager),
@@ -6,19 +6,55 @@ from graiax.shortcut.commander.saya import CommandSchema
 from ichika.client import Client
 from ichika.core import Friend, Member
 from ichika.graia.event import MessageEvent
-from ichika.message.elements import Image, MessageChain
+from ichika.message.elements import ForwardMessage, Image, MessageChain
 from kayaku import create
+from launart.saya import LaunchableSchema
 
+from library.render import RenderOverloaded
 from library.send_util import EventCtx, forward_node, msg
 
 from .render import results_to_images
 
 channel: Channel = Channel.current()
-from .service import SearchInterface, SphinxSearchConfig
+from .service import (
+    SearchInterface,
+    SearchResult,
+    SphinxSearchConfig,
+    SphinxSearchService,
+)
+
+channel.use(LaunchableSchema())(SphinxSearchService())
 
 
-def parse_query(phrase: str) -> str:
-    return f'''"{'" AND "'.join(phrase.split(" "))}"'''
+def result_nodes(
+    sender: Member | Friend,
+    idx: int,
+    res: SearchResult,
+    data: list[bytes] | int | None,
+) -> list[ForwardMessage]:
+    """`data` is the height of a result too tall to render, or `None` if it failed."""
+    title = f"#{idx}: {res.name} ({res.role})\n{res.uri}\n"
+    if data is None:
+        return [forward_node(sender, datetime.now(), msg([title, "截图失败"]))]
+    if isinstance(data, int):
+        return [
+            forward_node(
+                sender, datetime.now(), msg([title, f"元素高度为 {data}，无法截图"])
+            )
+        ]
+    return [
+        forward_node(
+            sender,
+            datetime.now(),
+            msg(
+                [
+                    title if part == 1 else f"#{idx} ({part}/{len(data)})\n",
+                    Image.build(image),
+                ]
+            ),
+        )
+        for part, image in enumerate(data, 1)
+    ]
 
 
 @channel.use(
@@ -27,6 +63,7 @@ def parse_query(phrase: str) -> str:
         {
             "total": Arg("[--total|-t] {total}", int, 5),
             "max_height": Arg("[--max-height|-h] {max_height}", int, 5000),
+            "inventory": Arg("[--inventory|-i] {inventory}", str, ""),
         },
     )
 )
@@ -34,6 +71,7 @@ async def handle(
     phrase: MessageChain,
     total: int,
     max_height: int,
+    inventory: str,
     event: MessageEvent,
     app: Client,
     interface: SearchInterface,
@@ -46,30 +84,27 @@ async def handle(
         return await ctx.send(f"{total} 条这怎么搜")
     if max_height not in range(500, 17500):
         return await ctx.send(f"{max_height} 这个高度怎么想都不对劲吧")
-    result = await interface.search(parse_query(str(phrase)), total)
-    images = await results_to_images(result, max_height)
-    forward_card = await ctx.upload_forward(
-        [
-            forward_node(
-                sender,
-                datetime.now(),
-                msg(f"共有 {len(result)} 条结果"),
-            ),
-            *(
-                forward_node(
-                    sender,
-                    datetime.now(),
-                    msg(
-                        [
-                            f"#{idx}: {res.name} ({res.role})\n{res.uri}\n",
-                            Image.build(data)
-                            if isinstance(data := images.pop(res.uri, -1), bytes)
-                            else f"元素高度为 {data}，无法截图",
-                        ]
-                    ),
-                )
-                for idx, res in enumerate(result, 1)
-            ),
-        ]
-    )
-    await ctx.send(forward_card)
+    config = create(SphinxSearchConfig)
+    scope = None
+    if inventory:
+        scope = [u for u in map(str, config.inventory_urls) if inventory in u]
+        if not scope:
+            return await ctx.send(f"没有匹配 {inventory} 的文档")
+    result = await interface.search(str(phrase), total, scope)
+    # Results may share a URI, each of them gets the image under its own number
+    positions: dict[str, list[int]] = {}
+    for idx, res in enumerate(result, 1):
+        positions.setdefault(res.uri, []).append(idx)
+    nodes: dict[int, list[ForwardMessage]] = {}
+    try:
+        async for uri, data in results_to_images(
+            result, max_height, config.max_tiles, config.render_concurrency
+        ):
+            for idx in positions.get(uri, []):
+                nodes[idx] = result_nodes(sender, idx, result[idx - 1], data)
+    except RenderOverloaded:
+        return await ctx.send("渲染队列繁忙，请稍后再试")
+    forward = [forward_node(sender, datetime.now(), msg(f"共有 {len(result)} 条结果"))]
+    for idx, res in enumerate(result, 1):
+        forward.extend(nodes.get(idx) or result_nodes(sender, idx, res, None))
+    await ctx.send(await ctx.upload_forward(forward))
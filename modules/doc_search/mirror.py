@@ -0,0 +1,109 @@
+import asyncio
+import re
+from pathlib import Path
+
+import msgspec
+from httpx import AsyncClient
+from loguru import logger
+from yarl import URL
+
+from library.storage import dir
+
+HEAD = re.compile(rb"<head[^>]*>", re.IGNORECASE)
+
+
+class PageMeta(msgspec.Struct):
+    path: str
+    etag: str | None = None
+    last_modified: str | None = None
+
+
+class DocMirror:
+    """Local copies of documentation pages, refreshed with conditional requests."""
+
+    root: Path
+    pages: dict[str, PageMeta]
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self.index_file = root / "index.msgpack"
+        self.pages = {}
+        if self.index_file.exists():
+            try:
+                self.pages = msgspec.msgpack.decode(
+                    self.index_file.read_bytes(), type=dict[str, PageMeta]
+                )
+            except msgspec.DecodeError:
+                logger.warning("Documentation mirror index is corrupted, rebuilding")
+
+    def path_of(self, url: str) -> Path:
+        u = URL(url)
+        rel = u.path.lstrip("/")
+        if not rel or rel.endswith("/"):
+            rel += "index.html"
+        path = (self.root / (u.host or "_") / rel).resolve()
+        if not path.is_relative_to(self.root):
+            raise ValueError(f"Refusing to mirror {url} outside of {self.root}")
+        return path
+
+    def local_url(self, url: str) -> str | None:
+        if (meta := self.pages.get(url)) is None:
+            return None
+        path = self.root / meta.path
+        return path.as_uri() if path.exists() else None
+
+    async def fetch(self, client: AsyncClient, url: str) -> bool:
+        meta = self.pages.get(url)
+        headers: dict[str, str] = {}
+        if meta and meta.etag:
+            headers["If-None-Match"] = meta.etag
+        if meta and meta.last_modified:
+            headers["If-Modified-Since"] = meta.last_modified
+        resp = await client.get(url, headers=headers)
+        if resp.status_code == 304:
+            return False
+        resp.raise_for_status()
+        path = self.path_of(url)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        # Relative stylesheets and scripts still resolve against the original site
+        html = HEAD.sub(
+            lambda m: m[0] + f'<base href="{url}">'.encode(), resp.content, count=1
+        )
+        await asyncio.to_thread(path.write_bytes, html)
+        self.pages[url] = PageMeta(
+            str(path.relative_to(self.root)),
+            resp.headers.get("ETag"),
+            resp.headers.get("Last-Modified"),
+        )
+        return True
+
+    async def sync(self, urls: set[str], concurrency: int) -> None:
+        slots = asyncio.Semaphore(concurrency)
+        updated = failed = 0
+
+        async def run(url: str) -> None:
+            nonlocal updated, failed
+            async with slots:
+                try:
+                    updated += await self.fetch(client, url)
+                except Exception as e:
+                    failed += 1
+                    logger.warning(f"Failed to mirror {url}: {e!r}")
+
+        async with AsyncClient(follow_redirects=True) as client:
+            await asyncio.gather(*map(run, urls))
+        self.index_file.write_bytes(msgspec.msgpack.encode(self.pages))
+        logger.info(
+            f"Documentation mirror synced: {len(urls)} pages, "
+            f"{updated} updated, {failed} failed"
+        )
+
+
+_mirror: DocMirror | None = None
+
+
+def get_mirror() -> DocMirror:
+    global _mirror
+    if _mirror is None:
+        _mirror = DocMirror(dir("doc_search") / "mirror")
+    return _mirror
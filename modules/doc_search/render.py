@@ -1,28 +1,132 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import AsyncGenerator
+
+import msgspec
+from kayaku import create
+from playwright.async_api import Page
 from yarl import URL
 
-from library.render import get_page
+from library.render import (
+    DEFAULT_PROFILE,
+    RenderCache,
+    SingleFlight,
+    TabCache,
+    element_tiles,
+    get_cache,
+    get_page,
+    postprocess,
+)
+
+from .mirror import get_mirror
+from .service import SearchResult, SphinxSearchConfig
+
+# Sphinx themes ship icon fonts in _static, which do show up in screenshots
+PROFILE = DEFAULT_PROFILE.extend(
+    frozenset({"font"}), allow=(r"/_static/.*\.(woff2?|ttf|otf)(\?|$)",)
+)
+SELECTOR = """//*[@href="#{frag}" and @class="headerlink"]/../.."""
+
+
+tabs = TabCache(
+    create(SphinxSearchConfig).keep_alive_tabs,
+    create(SphinxSearchConfig).tab_idle_timeout,
+)
+
+
+@asynccontextmanager
+async def open_page(base_url: str) -> AsyncGenerator[Page, None]:
+    if create(SphinxSearchConfig).mirror:
+        base_url = get_mirror().local_url(base_url) or base_url
+    if tabs.max_tabs > 0:
+        async with tabs.open(base_url, PROFILE) as page:
+            yield page
+        return
+    async with get_page(base_url, profile=PROFILE) as page:
+        await page.goto(base_url, wait_until="networkidle")
+        yield page
+
 
-from .service import SearchResult
+# Identical searches at the same time share the render of each page
+pages: SingleFlight[dict[str, list[bytes] | int]] = SingleFlight()
+
+
+def cache_key(uri: str, max_height: int) -> str:
+    # Tiles are cut by max_height, so it is part of the key
+    return RenderCache.key(uri, f"{SELECTOR} tiles={max_height}")
+
+
+async def render_page(
+    base_url: str, frags: list[str], max_height: int, max_tiles: int
+) -> dict[str, list[bytes] | int]:
+    cache = get_cache()
+    rendered: dict[str, list[bytes] | int] = {}
+    async with open_page(base_url) as page:
+        for frag in frags:
+            uri = str(URL(base_url).with_fragment(frag))
+            elem = await page.locator(SELECTOR.format(frag=frag)).element_handle()
+            height = await elem.evaluate("element => element.scrollHeight")
+            if height > max_height * max_tiles:
+                rendered[uri] = height
+                continue
+            if height <= max_height:
+                images = [await postprocess(await elem.screenshot())]
+            else:
+                images = [
+                    await postprocess(tile)
+                    async for tile in element_tiles(page, elem, max_height)
+                ]
+            rendered[uri] = images
+            await cache.put(
+                "doc_search",
+                cache_key(uri, max_height),
+                msgspec.msgpack.encode(images),
+            )
+    return rendered
 
 
 async def results_to_images(
-    results: list[SearchResult], max_height: int
-) -> dict[str, bytes | int]:
+    results: list[SearchResult], max_height: int, max_tiles: int, concurrency: int
+) -> AsyncGenerator[tuple[str, list[bytes] | int], None]:
+    """Screenshot each result, splitting ones taller than `max_height` into tiles.
+
+    Results that would need more than `max_tiles` tiles are reported by their height.
+    Up to `concurrency` pages are rendered at once, and results are yielded as soon as
+    their page is ready, in no particular order.
+    """
+    cache = get_cache()
     merged: dict[str, list[str]] = {}
-    result: dict[str, bytes | int] = {}
     for r in results:
+        if (data := await cache.get(cache_key(r.uri, max_height))) is not None:
+            yield r.uri, msgspec.msgpack.decode(data, type=list[bytes])
+            continue
         u = URL(r.uri)
         merged.setdefault(str(u.with_fragment(None)), []).append(u.fragment)
 
-    for base_url, frags in merged.items():
-        async with get_page() as page:
-            await page.goto(base_url, wait_until="networkidle")
-            for frag in frags:
-                elem = await page.locator(
-                    f"""//*[@href="#{frag}" and @class="headerlink"]/../.."""
-                ).element_handle()
-                height = await elem.evaluate("element => element.scrollHeight")
-                result[str(URL(base_url).with_fragment(frag))] = (
-                    (await elem.screenshot()) if height <= max_height else height
+    out: asyncio.Queue[tuple[str, list[bytes] | int] | None] = asyncio.Queue()
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run(base_url: str, frags: list[str]) -> None:
+        try:
+            async with slots:
+                rendered = await pages.run(
+                    (base_url, tuple(frags), max_height, max_tiles),
+                    lambda: render_page(base_url, frags, max_height, max_tiles),
                 )
-    return result
+            for item in rendered.items():
+                out.put_nowait(item)
+        finally:
+            out.put_nowait(None)  # Marks one page as finished
+
+    tasks = [asyncio.create_task(run(*item)) for item in merged.items()]
+    try:
+        for _ in tasks:
+            while (item := await out.get()) is not None:
+                yield item
+            for task in tasks:
+                if task.done() and not task.cancelled() and task.exception():
+                    task.result()  # Propagate render failures
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
@@ -1,24 +1,28 @@
 import asyncio
+import contextlib
+from collections import OrderedDict
+from collections.abc import AsyncGenerator, Iterator, Sequence
 from dataclasses import dataclass, field
+from difflib import SequenceMatcher
+from itertools import islice
+from pathlib import Path
 import sqlite3
+import time
 from zlib import adler32
 
 import aiosqlite
 from aiosqlite import Connection
-from graia.saya import Channel
-from httpx import AsyncClient
+from httpx import AsyncClient, HTTPStatusError, Timeout
 from kayaku import config, create
 from launart import ExportInterface, Service
-from launart.saya import LaunchableSchema
 from loguru import logger
-from rich.progress import MofNCompleteColumn, Progress, SpinnerColumn, TimeElapsedColumn
-from sphobjinv.inventory import Inventory
+from sphobjinv.re import pb_data
 from sphobjinv.zlib import decompress as sph_decompress
 from yarl import URL
 
 from library.storage import dir
 
-channel = Channel.current()
+from .mirror import get_mirror
 
 
 @dataclass(frozen=True, eq=True)
@@ -29,28 +33,262 @@ class SearchResult:
     uri: str
 
 
+class ReadPool:
+    """Read-only connections to the index, so searches run in parallel."""
+
+    connections: list[Connection]
+
+    def __init__(self, path: Path, size: int) -> None:
+        self.path = path
+        self.size = size
+        self.connections = []
+        self.idle: asyncio.Queue[Connection] = asyncio.Queue()
+
+    async def open(self) -> None:
+        for _ in range(self.size):
+            conn = await aiosqlite.connect(
+                f"{self.path.as_uri()}?mode=ro", uri=True, isolation_level=None
+            )
+            self.connections.append(conn)
+            self.idle.put_nowait(conn)
+
+    async def close(self) -> None:
+        for conn in self.connections:
+            await conn.close()
+        self.connections.clear()
+
+    @contextlib.asynccontextmanager
+    async def connection(self) -> AsyncGenerator[Connection, None]:
+        conn = await self.idle.get()
+        try:
+            yield conn
+        finally:
+            self.idle.put_nowait(conn)
+
+
+QueryKey = tuple[str, int, frozenset[str] | None]
+
+# Fuzzy matches are re-ranked from this many candidates per wanted result
+FUZZY_CANDIDATES = 10
+
+
+class QueryCache:
+    """LRU of search results, invalidated whenever the index is rebuilt."""
+
+    entries: OrderedDict[QueryKey, list[SearchResult]]
+
+    def __init__(self, size: int) -> None:
+        self.size = size
+        self.entries = OrderedDict()
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: QueryKey) -> list[SearchResult] | None:
+        if (results := self.entries.get(key)) is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return results
+
+    def put(self, key: QueryKey, generation: int, results: list[SearchResult]) -> None:
+        if generation != self.generation or self.size <= 0:
+            return  # Queried before the index was swapped, may be outdated
+        self.entries[key] = results
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def invalidate(self) -> None:
+        self.generation += 1
+        self.entries.clear()
+
+
 class SearchInterface(ExportInterface):
     service: "SphinxSearchService"
 
     def __init__(self, service: "SphinxSearchService") -> None:
         self.service = service
-        self.conn = self.service.connection
 
-    async def search(self, query: str, total: int):
+    async def match(
+        self,
+        conn: Connection,
+        table: str,
+        expr: str,
+        limit: int,
+        inventories: Sequence[str] | None,
+    ) -> list[SearchResult]:
+        sql = (
+            f"SELECT {table}.rank, objects.role, objects.name, objects.uri"
+            f" FROM {table}"
+            f" JOIN objects ON objects.id = {table}.rowid"
+            f" WHERE {table} MATCH ?"
+        )
+        params: list[str | int] = [expr]
+        if inventories is not None:
+            sql += f" AND inventory IN ({', '.join('?' * len(inventories))})"
+            params.extend(inventories)
+        async with conn.execute(
+            f"{sql} ORDER BY {table}.rank LIMIT ?;", (*params, limit)
+        ) as cursor:
+            return [SearchResult(*row) async for row in cursor]
+
+    async def search(
+        self, phrase: str, total: int, inventories: Sequence[str] | None = None
+    ) -> list[SearchResult]:
+        """Top `total` matches across all inventories, or only across `inventories`.
+
+        Names containing every term of `phrase` rank first, then names starting with
+        the terms. Only when neither matches, names sharing the most trigrams with the
+        terms are returned, to catch typos.
+        """
+        if not (terms := phrase.split()):
+            return []
+        cache = self.service.query_cache
+        key: QueryKey = (
+            " ".join(terms),
+            total,
+            None if inventories is None else frozenset(inventories),
+        )
+        if (cached := cache.get(key)) is not None:
+            return cached
+        generation = cache.generation
         results: list[SearchResult] = []
-        for db_name_js in self.service.config.inventory_urls:
-            async for row in await self.conn.execute(
-                f"SELECT rank, role, name, uri FROM {str(db_name_js)!r}(?)"
-                f" ORDER BY rank LIMIT ?;",
-                (query, total),
-            ):
-                results.append(SearchResult(*row))
-        results.sort(key=lambda r: r.rank)
-        return results[:total]
+        seen: set[tuple[str, str]] = set()
+
+        def extend(tier: list[SearchResult]) -> None:
+            for res in tier:
+                if len(results) < total and (res.name, res.uri) not in seen:
+                    seen.add((res.name, res.uri))
+                    results.append(res)
+
+        async with self.service.readers.connection() as conn:
+            exact = " AND ".join(map(quote, terms))
+            extend(await self.match(conn, "objects_fts", exact, total, inventories))
+            if len(results) < total:
+                prefix = " AND ".join(f"{quote(t)}*" for t in terms)
+                extend(
+                    await self.match(conn, "objects_fts", prefix, total, inventories)
+                )
+            grams = {t.lower()[i : i + 3] for t in terms for i in range(len(t) - 2)}
+            if not results and grams:
+                candidates = await self.match(
+                    conn,
+                    "objects_trigram",
+                    " OR ".join(map(quote, sorted(grams))),
+                    total * FUZZY_CANDIDATES,
+                    inventories,
+                )
+                scored = [
+                    SearchResult(-similarity(terms, c.name), c.role, c.name, c.uri)
+                    for c in candidates
+                ]
+                extend(sorted(scored, key=lambda r: r.rank))
+        cache.put(key, generation, results)
+        return results
+
+
+def quote(term: str) -> str:
+    escaped = term.replace('"', '""')
+    return f'"{escaped}"'
+
+
+def similarity(terms: list[str], name: str) -> float:
+    query = ".".join(terms).lower()
+    name = name.lower()
+    return max(
+        SequenceMatcher(None, query, name).ratio(),
+        SequenceMatcher(None, query, name.rpartition(".")[2]).ratio(),
+    )
+
+
+# FTS5 keeps `content=` as written, renaming a table does not update it. The indexes
+# of the shadow tables read "objects" for that reason, and are only valid after `SWAP`
+# renames them over the live ones. Until then they are filled with explicit inserts,
+# and must not be queried, rebuilt or integrity-checked.
+OBJECTS_TABLES = """
+CREATE TABLE IF NOT EXISTS {name}(
+    id INTEGER PRIMARY KEY,
+    inventory TEXT NOT NULL,
+    name TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    role TEXT NOT NULL,
+    uri TEXT NOT NULL
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS {name}_fts USING FTS5(
+    name, content='objects', content_rowid='id', prefix='2 3'
+);
+CREATE VIRTUAL TABLE IF NOT EXISTS {name}_trigram USING FTS5(
+    name, content='objects', content_rowid='id', tokenize='trigram'
+);
+"""
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS hashes(uri PRIMARY KEY, value, etag, last_modified);
+{OBJECTS_TABLES.format(name="objects")}
+CREATE INDEX IF NOT EXISTS objects_inventory ON objects(inventory, domain);
+-- Rows are never changed in place, the whole index is rebuilt and swapped in
+DROP TRIGGER IF EXISTS objects_insert;
+DROP TRIGGER IF EXISTS objects_delete;
+"""
+
+# Shadow tables are renamed over the live ones in a single transaction
+SWAP = (
+    "DROP TABLE objects_fts;",
+    "DROP TABLE objects_trigram;",
+    "DROP TABLE objects;",
+    "ALTER TABLE objects_next RENAME TO objects;",
+    "ALTER TABLE objects_next_fts RENAME TO objects_fts;",
+    "ALTER TABLE objects_next_trigram RENAME TO objects_trigram;",
+    "CREATE INDEX objects_inventory ON objects(inventory, domain);",
+)
+
+
+BATCH_SIZE = 5000
+
+
+def connect(path: Path) -> sqlite3.Connection:
+    conn = sqlite3.connect(path, isolation_level=None)
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    return conn
+
+
+@contextlib.contextmanager
+def transaction(conn: sqlite3.Connection) -> Iterator[None]:
+    conn.execute("BEGIN IMMEDIATE;")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK;")
+        raise
+    conn.execute("COMMIT;")
+
 
+def create_schema(conn: sqlite3.Connection) -> None:
+    legacy = not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'objects';"
+    ).fetchone()
+    outdated = not conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'objects_trigram';"
+    ).fetchone()
+    conn.executescript(SCHEMA)
+    columns = {row[1] for row in conn.execute("PRAGMA table_info(hashes);")}
+    for column in ("etag", "last_modified"):
+        if column not in columns:
+            conn.execute(f"ALTER TABLE hashes ADD COLUMN {column};")
+    if legacy:  # Drop the per-inventory tables of older versions
+        for (url,) in conn.execute("SELECT uri FROM hashes;").fetchall():
+            conn.execute(f"DROP TABLE IF EXISTS {url!r};")
+    if legacy or outdated:  # Forget the hashes, so the next refresh rebuilds all
+        conn.execute("DELETE FROM hashes;")
 
-DB = dir("doc_search") / "objects.db"
-DB.touch(exist_ok=True)
+
+@dataclass
+class FetchedInventory:
+    data: bytes
+    etag: str | None = None
+    last_modified: str | None = None
 
 
 @config("search.sphinx")
@@ -63,14 +301,54 @@ class SphinxSearchConfig:
     domains: list[str] = field(default_factory=lambda: ["py"])
     """Acceptable domains."""
 
+    fetch_retries: int = 5
+    """Times to retry downloading an objects.inv before keeping its last index."""
+
+    fetch_timeout: float = 30
+    """Seconds to wait for an objects.inv to download."""
+
+    read_connections: int = 4
+    """Number of database connections serving searches in parallel."""
+
+    query_cache_size: int = 512
+    """Number of search results kept in memory, 0 to disable."""
+
+    refresh_interval: float = 86400
+    """Seconds between refreshes of the inventories, 0 to only refresh on startup."""
+
+    max_tiles: int = 6
+    """Results taller than `--max-height` are split into at most this many images."""
+
+    render_concurrency: int = 3
+    """Max number of documentation pages rendered at the same time for one search."""
+
+    keep_alive_tabs: int = 2
+    """Number of doc pages kept open, 0 to disable, must be below the page pool size."""
+
+    tab_idle_timeout: float = 300
+    """Seconds an unused documentation page is kept open."""
+
+    mirror: bool = False
+    """Download pages referenced by the inventories and render from local copies."""
+
+    mirror_concurrency: int = 8
+    """Max number of pages downloaded at the same time when mirroring."""
+
     command: str = "[#search|#搜|搜文档] {...phrase:raw}"
 
 
 class SphinxSearchService(Service):
     id = "service.search.sphinx"
     supported_interface_types = {SearchInterface}
-    connection: Connection
+    db: Path
+    readers: ReadPool
+    query_cache: QueryCache
     config: SphinxSearchConfig
+    refresh_task: asyncio.Task | None = None
+
+    def __init__(self, db: Path | None = None) -> None:
+        self.db = db or dir("doc_search") / "objects.db"
+        super().__init__()
 
     @property
     def stages(self):
@@ -83,85 +361,223 @@ class SphinxSearchService(Service):
     def get_interface(self, _):
         return SearchInterface(self)
 
-    def write_table(self, conn: sqlite3.Connection, url: str, inv: Inventory) -> None:
+    def iter_objects(
+        self, url: str, data: bytes
+    ) -> Iterator[tuple[str, str, str, str, str]]:
+        """Lazily decode rows of the compressed inventory, skipping unwanted domains."""
         head_uri = f"{str(URL(url).parent)}/"
-        logger.info(f"Traversing {len(inv.objects)} entries of {url}")
-        with Progress(
-            SpinnerColumn(),
-            *Progress.get_default_columns(),
-            TimeElapsedColumn(),
-            MofNCompleteColumn(),
-        ) as prog:
-            tid = prog.add_task(
-                f"[cyan]Writing {len(inv.objects)} entries into database[/]",
-                total=len(inv.objects),
+        domains = set(self.config.domains)
+        for m in pb_data.finditer(sph_decompress(data)):
+            domain = m["domain"].decode()
+            if domain not in domains:
+                continue
+            name = m["name"].decode()
+            uri = m["uri"].decode()
+            if uri.endswith("$"):
+                uri = uri[:-1] + name
+            yield url, name, domain, m["role"].decode(), head_uri + uri
+
+    def write_objects(self, conn: sqlite3.Connection, url: str, data: bytes) -> int:
+        objects = self.iter_objects(url, data)
+        count = 0
+        while batch := list(islice(objects, BATCH_SIZE)):
+            conn.executemany(
+                "INSERT INTO objects_next(inventory, name, domain, role, uri)"
+                " VALUES (?, ?, ?, ?, ?);",
+                batch,
             )
-            for d in inv.objects:
-                dct = d.json_dict(expand=True)
-                dct["uri"] = head_uri + dct["uri"]
-                if dct["domain"] in self.config.domains:
-                    conn.execute(
-                        f"INSERT INTO {url!r} VALUES (:name, :domain, :role, :uri);",
-                        dct,
-                    )
-                prog.advance(tid)
-
-    def update_objects_data(
-        self, conn: sqlite3.Connection, url: str, data: bytes
+            count += len(batch)
+        return count
+
+    def rebuild(
+        self,
+        conn: sqlite3.Connection,
+        urls: list[str],
+        changed: dict[str, FetchedInventory],
     ) -> None:
-        file_hash = adler32(data)
-        rows = list(
-            conn.execute("SELECT * FROM hashes WHERE uri = ?;", (url,)).fetchall()
-        )
-        if not rows:
+        """Build the index into shadow tables, then swap them in at once.
+
+        Rows of inventories in `urls` that did not change are copied over.
+        """
+        start = time.perf_counter()
+        conn.execute("DROP TABLE IF EXISTS objects_next_fts;")
+        conn.execute("DROP TABLE IF EXISTS objects_next_trigram;")
+        conn.execute("DROP TABLE IF EXISTS objects_next;")
+        conn.executescript(OBJECTS_TABLES.format(name="objects_next"))
+        kept = [url for url in urls if url not in changed]
+        with transaction(conn):
             conn.execute(
-                "INSERT INTO hashes(uri, value) VALUES (?, ?);",
-                (url, -1),
+                "INSERT INTO objects_next(inventory, name, domain, role, uri)"
+                " SELECT inventory, name, domain, role, uri FROM objects"
+                f" WHERE inventory IN ({', '.join('?' * len(kept))});",
+                kept,
             )
-        elif rows[0][1] == file_hash:
-            logger.debug(f"{url}'s object data is already up to date, skipping")
-            return
-        logger.debug(f"Remove and recreate table {url}")
-        conn.execute(f"DROP TABLE IF EXISTS {url!r};")
-        conn.execute(
-            f"CREATE VIRTUAL TABLE {url!r} USING FTS5(name, domain UNINDEXED, role UNINDEXED, uri UNINDEXED);"
-        )
-        inv = Inventory(sph_decompress(data))  # type: ignore
-        self.write_table(conn, url, inv)
-        logger.debug(f"Updating {url}'s file hash")
-        conn.execute(
-            "REPLACE INTO hashes VALUES(?, ?)",
-            (url, file_hash),
+            for url, inv in changed.items():
+                ingest_start = time.perf_counter()
+                count = self.write_objects(conn, url, inv.data)
+                elapsed = time.perf_counter() - ingest_start
+                logger.info(
+                    f"Indexed {count} objects of {url} in {elapsed:.2f}s"
+                    f" ({count / max(elapsed, 1e-6):.0f} rows/s)"
+                )
+            # One pass over all rows is far cheaper than a trigger per row
+            for index in ("objects_next_fts", "objects_next_trigram"):
+                conn.execute(
+                    f"INSERT INTO {index}(rowid, name) SELECT id, name FROM objects_next;"
+                )
+        with transaction(conn):
+            for statement in SWAP:
+                conn.execute(statement)
+            conn.execute(
+                f"DELETE FROM hashes WHERE uri NOT IN ({', '.join('?' * len(urls))});",
+                urls,
+            )
+            conn.executemany(
+                "REPLACE INTO hashes VALUES(?, ?, ?, ?);",
+                [
+                    (url, adler32(inv.data), inv.etag, inv.last_modified)
+                    for url, inv in changed.items()
+                ],
+            )
+        logger.info(
+            f"Rebuilt documentation index in {time.perf_counter() - start:.2f}s"
         )
 
-    async def launch(self, _):
-        async with self.stage("preparing"):
-            self.config = conf = create(SphinxSearchConfig)
-            conn = sqlite3.connect(DB, isolation_level=None)
-            conn.execute("CREATE TABLE IF NOT EXISTS hashes(uri PRIMARY KEY, value);")
-            conn.execute("CREATE TABLE IF NOT EXISTS hashes(uri PRIMARY KEY, value);")
-            data_map: dict[str, bytes] = {}
-            async with AsyncClient() as client:
-                for url in conf.inventory_urls:
-                    url = str(url)  # Convert JString
-                    data = None
-                    while data is None:
-                        try:
-                            data = (await client.get(url)).content
-                        except Exception as e:
-                            logger.error(f"Error fetching {url}: {e!r}, retrying")
-                            await asyncio.sleep(0.5)
-                    logger.debug(f"Fetched objects.inv from {url}")
-                    data_map[url] = data
-            for url, data in data_map.items():
-                self.update_objects_data(conn, url, data)
+    def prepare_index(self) -> None:
+        conn = connect(self.db)
+        try:
+            create_schema(conn)
+        finally:
             conn.close()
 
-            self.connection_mgr = aiosqlite.connect(DB, isolation_level=None)
-            self.connection = await self.connection_mgr.__aenter__()
+    def load_validators(self) -> dict[str, tuple[str | None, str | None]]:
+        conn = connect(self.db)
+        try:
+            return {
+                url: (etag, last_modified)
+                for url, etag, last_modified in conn.execute(
+                    "SELECT uri, etag, last_modified FROM hashes;"
+                )
+            }
+        finally:
+            conn.close()
 
-        async with self.stage("cleanup"):
-            await self.connection_mgr.__aexit__(None, None, None)
+    def build_index(self, fetched: dict[str, FetchedInventory]) -> bool:
+        """Index fetched inventories in a worker thread.
 
+        Returns whether the index was rebuilt.
+        """
+        urls = list(map(str, self.config.inventory_urls))
+        conn = connect(self.db)
+        try:
+            hashes = dict(conn.execute("SELECT uri, value FROM hashes;").fetchall())
+            changed: dict[str, FetchedInventory] = {}
+            for url, inv in fetched.items():
+                if hashes.get(url) != adler32(inv.data):
+                    changed[url] = inv
+                    continue
+                logger.debug(f"{url}'s object data is already up to date, skipping")
+                conn.execute(
+                    "UPDATE hashes SET etag = ?, last_modified = ? WHERE uri = ?;",
+                    (inv.etag, inv.last_modified, url),
+                )
+            if not changed and hashes.keys() <= set(urls):
+                return False
+            self.rebuild(conn, urls, changed)
+            return True
+        finally:
+            conn.close()
 
-channel.use(LaunchableSchema())(SphinxSearchService())
+    async def fetch(
+        self,
+        client: AsyncClient,
+        url: str,
+        validators: tuple[str | None, str | None] | None,
+    ) -> FetchedInventory | None:
+        """Download `url`, None if it is unchanged or could not be fetched."""
+        headers: dict[str, str] = {}
+        if validators and validators[0]:
+            headers["If-None-Match"] = validators[0]
+        if validators and validators[1]:
+            headers["If-Modified-Since"] = validators[1]
+        retries = self.config.fetch_retries
+        for attempt in range(retries + 1):
+            try:
+                resp = await client.get(url, headers=headers)
+                if resp.status_code == 304:
+                    logger.debug(f"objects.inv from {url} is not modified")
+                    return None
+                resp.raise_for_status()
+            except Exception as e:
+                client_error = (
+                    isinstance(e, HTTPStatusError)
+                    and e.response.is_client_error
+                    and e.response.status_code != 429
+                )
+                if client_error or attempt == retries:
+                    logger.error(f"Error fetching {url}: {e!r}, keeping its last index")
+                    return None
+                delay = min(0.5 * 2**attempt, 30)
+                logger.warning(f"Error fetching {url}: {e!r}, retrying in {delay}s")
+                await asyncio.sleep(delay)
+            else:
+                logger.debug(f"Fetched objects.inv from {url}")
+                return FetchedInventory(
+                    resp.content,
+                    resp.headers.get("ETag"),
+                    resp.headers.get("Last-Modified"),
+                )
+
+    async def fetch_all(self) -> dict[str, FetchedInventory]:
+        urls = list(map(str, self.config.inventory_urls))  # Convert JString
+        validators = await asyncio.to_thread(self.load_validators)
+        async with AsyncClient(
+            follow_redirects=True, timeout=Timeout(self.config.fetch_timeout)
+        ) as client:
+            results = await asyncio.gather(
+                *(self.fetch(client, url, validators.get(url)) for url in urls)
+            )
+        return {url: inv for url, inv in zip(urls, results) if inv is not None}
+
+    def referenced_pages(self) -> set[str]:
+        conn = connect(self.db)
+        try:
+            return {
+                str(URL(uri).with_fragment(None))
+                for (uri,) in conn.execute("SELECT uri FROM objects;")
+            }
+        finally:
+            conn.close()
+
+    async def refresh(self) -> None:
+        """Refresh the index now, then every `refresh_interval` seconds."""
+        while True:
+            try:
+                fetched = await self.fetch_all()
+                if await asyncio.to_thread(self.build_index, fetched):
+                    self.query_cache.invalidate()
+                if self.config.mirror:
+                    pages = await asyncio.to_thread(self.referenced_pages)
+                    await get_mirror().sync(pages, self.config.mirror_concurrency)
+            except Exception as e:
+                logger.exception(f"Failed to refresh documentation index: {e!r}")
+            if self.config.refresh_interval <= 0:
+                return
+            await asyncio.sleep(self.config.refresh_interval)
+
+    async def launch(self, _):
+        async with self.stage("preparing"):
+            self.config = conf = create(SphinxSearchConfig)
+            await asyncio.to_thread(self.prepare_index)
+            self.query_cache = QueryCache(conf.query_cache_size)
+            self.readers = ReadPool(self.db, max(conf.read_connections, 1))
+            await self.readers.open()
+            # Searches are served from the existing index while it is refreshed
+            self.refresh_task = asyncio.create_task(self.refresh())
+
+        async with self.stage("cleanup"):
+            if self.refresh_task:
+                self.refresh_task.cancel()
+                with contextlib.suppress(asyncio.CancelledError):
+                    await self.refresh_task
+            await self.readers.close()
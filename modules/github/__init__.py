@@ -1,5 +1,4 @@
 import contextlib
-import secrets
 from dataclasses import field
 from datetime import datetime
 from pathlib import Path
@@ -19,15 +18,17 @@ from ichika.client import Client
 from ichika.graia.event import FriendMessage, GroupMessage
 from ichika.message.elements import Image, MessageChain, Text
 from kayaku import config, create
-from loguru import logger
 from msgspec.msgpack import decode, encode
 
+from library.render import RenderOverloaded
 from library.send_util import EventCtx, forward_node, msg
 from library.storage import dir
 from library.validator import CertainFriend, Quoting
 
 from .auth import SCOPES, DeviceCodeResp, verify_auth
-from .render import files_changed_image, format_event, link_to_image
+from .card import issue_card_image
+from .notify import Notifier, SendLimiter
+from .render import files_changed_image, open_graph_image
 from .service import GitHub
 
 channel = Channel.current()
@@ -47,6 +48,46 @@ class OrgMonitor:
     """Set of Organizations that you want to monitor."""
     groups: list[int] = field(default_factory=list)
     """Target groups"""
+    min_interval: float = 60
+    """Seconds between polls of an active organization, at least `X-Poll-Interval`."""
+    max_interval: float = 600
+    """Seconds between polls of an organization that has been quiet for a while."""
+    reserve: int = 500
+    """Part of the rate limit kept for commands, polling slows down to stay above it."""
+    queue_size: int = 1000
+    """Max events queued per org and per digest, the oldest are dropped beyond it."""
+    digest_window: float = 30
+    """Seconds events are collected for, before being sent as one digest."""
+    send_concurrency: int = 4
+    """Max number of groups a digest is sent to at the same time, at least 1."""
+    send_rate: float = 1
+    """Max number of group messages started per second, at least 0.1."""
+
+
+@config("github.orgs.webhook")
+class OrgWebhook:
+    enabled: bool = False
+    """Receive org events by an org webhook, polling each org while none arrive."""
+    secret: str = ""
+    """Secret of the webhook, deliveries are rejected without a matching signature."""
+    host: str = "127.0.0.1"
+    """Address the webhook server listens on, put a reverse proxy in front of it."""
+    port: int = 8765
+    """Port the webhook server listens on."""
+    path: str = "/github/webhook"
+    """Path webhook deliveries are posted to."""
+    stale_after: float = 3600
+    """Seconds without deliveries from an org, before polling it again."""
+
+
+@config("github.cache")
+class ApiCache:
+    ttl: float = 60
+    """Seconds a cached issue or repo is used without asking GitHub if it changed."""
+    size: int = 2048
+    """Max number of cached responses, the least recently used are evicted."""
+    persist: bool = True
+    """Keep cached responses across restarts."""
 
 
 WORD = r"[A-Za-z0-9_-]"
@@ -86,9 +127,9 @@ async def render_link(
     ctx = EventCtx(app, ev)
 
     try:
-        issue_prop_pull_request = (
-            await gh.rest.issues.async_get(owner, repo, int(number))
-        ).parsed_data.pull_request
+        with gh.cached():
+            issue = await gh.rest.issues.async_get(owner, repo, int(number))
+        issue_prop_pull_request = issue.parsed_data.pull_request
     except Exception as e:
         return await ctx.send([ctx.as_reply, f"验证 Issue 失败：{repr(e)}"])
 
@@ -96,15 +137,23 @@ async def render_link(
         receipt = await ctx.send(
             [
                 ctx.as_reply,
-                Image.build(
-                    await link_to_image(
-                        f"https://github.com/{owner}/{repo}/issues/{number}"
-                    )
-                ),
+                Image.build(await issue_card_image(gh, owner, repo, issue.parsed_data)),
             ]
         )
     except TimeoutError:
-        return await ctx.send([ctx.as_reply, "Timeout in 80000ms!"])
+        return await ctx.send([ctx.as_reply, "渲染超时，请稍后再试"])
+    except RenderOverloaded:
+        return await ctx.send([ctx.as_reply, "渲染队列繁忙，请稍后再试"])
+    except Exception as e:
+        # Comments failed to load or the card failed to render, the link still helps
+        data = issue.parsed_data
+        receipt = await ctx.send(
+            [
+                ctx.as_reply,
+                f"{owner}/{repo}#{number}: {data.title}\n{data.html_url}\n"
+                f"渲染卡片失败：{repr(e)}",
+            ]
+        )
 
     if not issue_prop_pull_request:
         return
@@ -135,6 +184,8 @@ async def render_link(
         await ctx.send(card)
     except TimeoutError:
         return await ctx.send([ctx.as_reply, "Timeout in 80000ms!"])
+    except RenderOverloaded:
+        return await ctx.send([ctx.as_reply, "渲染队列繁忙，请稍后再试"])
 
 
 @channel.use(
@@ -159,36 +210,35 @@ async def render_open_graph(
     owner, repo = map(str, (owner_chain, repo_chain))
     ctx = EventCtx(app, ev)
     try:
-        await gh.rest.repos.async_get(owner, repo)
+        with gh.cached():
+            repo_data = (await gh.rest.repos.async_get(owner, repo)).parsed_data
     except Exception as e:
         return
     try:
-        pic = (
-            await (
-                await client.request(
-                    "get",
-                    f"https://opengraph.githubassets.com/{secrets.token_urlsafe(16)}/"
-                    f"{owner}/{repo}",
-                )
-            )
-            .io()
-            .read()
+        pic = await open_graph_image(
+            client,
+            repo_data.full_name,
+            f"pushed={repo_data.pushed_at} updated={repo_data.updated_at}",
         )
         return await ctx.send(Image.build(pic))
     except Exception as e:
         return await ctx.send([ctx.as_reply, f"拉取 OpenGraph 失败：{repr(e)}"])
 
 
+notifier = Notifier(create(OrgMonitor).queue_size)
+limiter = SendLimiter(create(OrgMonitor).send_concurrency, create(OrgMonitor).send_rate)
+
+
 @channel.use(SchedulerSchema(every_custom_seconds(5)))
 async def update_stat(app: Client, gh: GitHub):
-    groups: list[int] = create(OrgMonitor).groups
-    for events in gh.polls.values():
-        while events and (ev := events.popleft()):
-            # TODO: Render events
-            logger.debug(repr(ev))
-            if formatted := format_event(ev):
-                for g in groups:
-                    await app.send_group_message(g, msg(formatted))
+    monitor = create(OrgMonitor)
+    notifier.collect(gh.polls.values())
+    if notifier.due(monitor.digest_window):
+        await notifier.flush(
+            monitor.groups,
+            lambda g, text: app.send_group_message(g, msg(text)),
+            limiter,
+        )
 
 
 DB = dir("github") / "objects.db"
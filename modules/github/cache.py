@@ -0,0 +1,95 @@
+import time
+from collections import OrderedDict
+from contextvars import ContextVar
+from pathlib import Path
+
+import httpx
+import msgspec
+from loguru import logger
+
+# Response headers kept with cached bodies
+KEPT_HEADERS = ("Content-Type", "ETag", "Last-Modified")
+# Set by `GitHub.cached`, other requests bypass the cache
+caching: ContextVar[bool] = ContextVar("caching", default=False)
+
+
+class CachedResponse(msgspec.Struct):
+    content: bytes
+    headers: dict[str, str]
+    stored: float  # Unix timestamp of the last 200 or 304
+
+    @property
+    def validators(self) -> dict[str, str]:
+        headers: dict[str, str] = {}
+        if etag := self.headers.get("ETag"):
+            headers["If-None-Match"] = etag
+        if last_modified := self.headers.get("Last-Modified"):
+            headers["If-Modified-Since"] = last_modified
+        return headers
+
+    def response(self, request: httpx.Request) -> httpx.Response:
+        return httpx.Response(
+            200, headers=self.headers, content=self.content, request=request
+        )
+
+
+class ResponseCache:
+    """GET responses of the REST API by URL, revalidated with conditional requests.
+
+    Entries younger than `ttl` are served without a request. Older ones are sent with
+    their ETag and Last-Modified, and a 304 (which GitHub doesn't count against the
+    rate limit) refreshes them. The least recently used entries are evicted beyond
+    `size`.
+    """
+
+    entries: OrderedDict[str, CachedResponse]
+
+    def __init__(self, ttl: float, size: int, store: Path | None = None) -> None:
+        self.ttl = ttl
+        self.size = size
+        self.store = store
+        self.entries = OrderedDict()
+        self.hits = self.revalidated = self.misses = 0
+        if store is not None and store.exists():
+            try:
+                self.entries.update(
+                    msgspec.msgpack.decode(
+                        store.read_bytes(), type=dict[str, CachedResponse]
+                    )
+                )
+            except msgspec.DecodeError:
+                logger.warning("GitHub response cache is corrupted, starting over")
+
+    @staticmethod
+    def key(request: httpx.Request) -> str:
+        return str(request.url)
+
+    def get(self, key: str) -> CachedResponse | None:
+        if (entry := self.entries.get(key)) is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def fresh(self, entry: CachedResponse) -> bool:
+        return time.time() - entry.stored < self.ttl
+
+    def put(self, key: str, response: httpx.Response) -> None:
+        headers = {
+            h: response.headers[h] for h in KEPT_HEADERS if h in response.headers
+        }
+        self.entries[key] = CachedResponse(response.content, headers, time.time())
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def save(self) -> None:
+        if self.store is None:
+            return
+        tmp = self.store.with_suffix(".tmp")
+        tmp.write_bytes(msgspec.msgpack.encode(dict(self.entries)))
+        tmp.replace(self.store)
+
+    def __str__(self) -> str:
+        return (
+            f"{len(self.entries)} entries, {self.hits} hits,"
+            f" {self.revalidated} revalidated, {self.misses} misses"
+        )
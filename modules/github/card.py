@@ -0,0 +1,140 @@
+import html
+import re
+from pathlib import Path
+from string import Template
+
+from githubkit.rest.models import Issue, IssueComment, IssuePropLabelsItemsOneof1
+from kayaku import config, create
+from markdown_it import MarkdownIt
+from mdit_py_emoji import emoji_plugin
+from mdit_py_plugins.tasklists import tasklists_plugin
+
+from library.render import (
+    DEFAULT_PROFILE,
+    Priority,
+    RenderCache,
+    get_cache,
+    get_page,
+    postprocess,
+)
+
+from .service import GitHub
+
+TEMPLATE = Template((Path(__file__).parent / "card.html").read_text("utf-8"))
+# Issue templates are full of these, and raw HTML is not rendered
+HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+
+md = MarkdownIt("gfm-like", {"html": False}).use(emoji_plugin).use(tasklists_plugin)
+
+
+@config("github.card")
+class IssueCardConfig:
+    max_height: int = 3000
+    """Max height of an issue card in pixels, longer threads are cut off."""
+    comments: int = 5
+    """Number of comments shown below the description, from the first one."""
+
+
+def render_markdown(text: str | None) -> str:
+    if not text or not (text := HTML_COMMENT.sub("", text).strip()):
+        return '<p class="empty">No description provided.</p>'
+    return md.render(text)
+
+
+def render_label(label: str | IssuePropLabelsItemsOneof1) -> str:
+    if isinstance(label, str):
+        name, color = label, "6e7781"
+    else:
+        name, color = label.name or "", label.color or "6e7781"
+    r, g, b = (int(color[i : i + 2], 16) for i in (0, 2, 4))
+    fg = "#1f2328" if r * 0.299 + g * 0.587 + b * 0.114 > 150 else "#ffffff"
+    return (
+        f'<span class="label" style="background: #{color}; color: {fg}">'
+        f"{html.escape(name)}</span>"
+    )
+
+
+def render_comment(comment: Issue | IssueComment) -> str:
+    login = comment.user.login if comment.user else "ghost"
+    avatar = comment.user.avatar_url if comment.user else ""
+    return (
+        '<div class="comment"><div class="header">'
+        f'<img src="{html.escape(avatar)}"><b>{html.escape(login)}</b>'
+        f" commented on {comment.created_at:%Y-%m-%d}</div>"
+        f'<div class="markdown">{render_markdown(comment.body or None)}</div></div>'
+    )
+
+
+def state_of(issue: Issue) -> tuple[str, str]:
+    """Label and CSS class of the state badge."""
+    if not issue.pull_request:
+        if issue.state == "closed" and issue.state_reason == "not_planned":
+            return "Closed", "state not_planned"
+        return issue.state.capitalize(), f"state {issue.state}"
+    if issue.pull_request.merged_at:
+        return "Merged", "state pr merged"
+    if issue.draft and issue.state == "open":
+        return "Draft", "state pr draft"
+    return issue.state.capitalize(), f"state pr {issue.state}"
+
+
+def build_card(
+    issue: Issue, comments: list[IssueComment], repo: str, max_height: int
+) -> str:
+    """HTML of the card of `issue`, with its description and `comments`."""
+    state, state_class = state_of(issue)
+    author = issue.user.login if issue.user else "ghost"
+    kind = "pull request" if issue.pull_request else "issue"
+    more = issue.comments - len(comments)
+    return TEMPLATE.substitute(
+        max_height=max_height,
+        repo=html.escape(repo),
+        title=md.renderInline(issue.title),
+        number=issue.number,
+        state=state,
+        state_class=state_class,
+        info=html.escape(
+            f"{author} opened this {kind} on {issue.created_at:%Y-%m-%d}"
+            f" · {issue.comments} comments"
+        ),
+        labels="".join(map(render_label, issue.labels)),
+        comments="".join(map(render_comment, [issue, *comments])),
+        more=f'<div class="more">{more} more comments</div>' if more > 0 else "",
+    )
+
+
+async def render_card(gh: GitHub, owner: str, repo: str, issue: Issue) -> bytes:
+    cfg = create(IssueCardConfig)
+    comments: list[IssueComment] = []
+    if cfg.comments > 0 and issue.comments > 0:
+        with gh.cached():
+            comments = (
+                await gh.rest.issues.async_list_comments(
+                    owner, repo, issue.number, per_page=cfg.comments
+                )
+            ).parsed_data
+    content = build_card(issue, comments, f"{owner}/{repo}", cfg.max_height)
+    async with get_page(issue.html_url, Priority.HIGH, DEFAULT_PROFILE) as page:
+        # Only images (avatars and attachments) are loaded, nothing is navigated to
+        await page.set_content(content, timeout=20000, wait_until="networkidle")
+        card = page.locator("#card")
+        await card.evaluate(
+            "card => card.classList.toggle("
+            "'truncated', card.scrollHeight > card.clientHeight)"
+        )
+        shot = await card.screenshot()
+    return await postprocess(shot)
+
+
+async def issue_card_image(gh: GitHub, owner: str, repo: str, issue: Issue) -> bytes:
+    """Card of `issue` rendered from API data, with its first comments."""
+    cfg = create(IssueCardConfig)
+    # New comments and edits all bump updated_at
+    key = RenderCache.key(
+        issue.html_url,
+        f"card updated={issue.updated_at} comments={cfg.comments}"
+        f" height={cfg.max_height}",
+    )
+    return await get_cache().fetch(
+        "github", key, lambda: render_card(gh, owner, repo, issue)
+    )
@@ -0,0 +1,131 @@
+"""Compact models of the org events `format_event` reports.
+
+Poll responses are decoded with msgspec straight into these, instead of full githubkit
+models. Events of other types are only decoded as far as their id.
+"""
+from datetime import datetime
+
+import msgspec
+from loguru import logger
+
+
+class EventHead(msgspec.Struct):
+    id: str
+    type: str
+
+
+class Actor(msgspec.Struct):
+    login: str
+
+
+class Repo(msgspec.Struct):
+    name: str
+
+
+class OrgEvent(EventHead, kw_only=True):
+    actor: Actor
+    repo: Repo
+    created_at: datetime
+
+
+class PushPayload(msgspec.Struct):
+    ref: str
+    head: str
+    before: str
+    distinct_size: int | None = None  # Not always sent by the events API
+
+
+class Release(msgspec.Struct):
+    url: str
+    name: str | None = None
+    draft: bool = False
+
+
+class ReleasePayload(msgspec.Struct):
+    action: str
+    release: Release
+
+
+class Issue(msgspec.Struct):
+    number: int
+    title: str
+    html_url: str
+
+
+class IssuesPayload(msgspec.Struct):
+    action: str
+    issue: Issue
+
+
+class PullRequest(msgspec.Struct):
+    number: int
+    title: str | None = None
+    html_url: str | None = None
+
+
+class PullRequestPayload(msgspec.Struct):
+    action: str
+    pull_request: PullRequest
+
+
+class Review(msgspec.Struct):
+    state: str
+    html_url: str | None = None
+
+
+class PullRequestReviewPayload(msgspec.Struct):
+    action: str
+    pull_request: PullRequest
+    review: Review
+
+
+class PushEvent(OrgEvent, kw_only=True):
+    payload: PushPayload
+
+
+class ReleaseEvent(OrgEvent, kw_only=True):
+    payload: ReleasePayload
+
+
+class IssuesEvent(OrgEvent, kw_only=True):
+    payload: IssuesPayload
+
+
+class PullRequestEvent(OrgEvent, kw_only=True):
+    payload: PullRequestPayload
+
+
+class PullRequestReviewEvent(OrgEvent, kw_only=True):
+    payload: PullRequestReviewPayload
+
+
+DECODERS: dict[str, msgspec.json.Decoder] = {
+    cls.__name__: msgspec.json.Decoder(cls)
+    for cls in (
+        PushEvent,
+        ReleaseEvent,
+        IssuesEvent,
+        PullRequestEvent,
+        PullRequestReviewEvent,
+    )
+}
+raw_list_decoder = msgspec.json.Decoder(list[msgspec.Raw])
+head_decoder = msgspec.json.Decoder(EventHead)
+
+
+def decode_events(data: bytes) -> list[EventHead]:
+    """Decode an events API response, handled types become `OrgEvent`s.
+
+    Events of handled types that fail to decode are kept as `EventHead`, so their ids
+    are still remembered.
+    """
+    events: list[EventHead] = []
+    for raw in raw_list_decoder.decode(data):
+        head = head_decoder.decode(raw)
+        if (decoder := DECODERS.get(head.type)) is not None:
+            try:
+                head = decoder.decode(raw)
+            except msgspec.ValidationError as e:
+                logger.warning(f"Skipping malformed {head.type} {head.id}: {e}")
+        events.append(head)
+    return events
@@ -0,0 +1,166 @@
+import asyncio
+import time
+from collections import deque
+from collections.abc import Awaitable, Callable, Iterable
+
+from loguru import logger
+
+from .events import IssuesEvent, OrgEvent, PullRequestEvent, PushEvent
+from .render import format_event, pull_request_url
+
+# Issue and PR actions merged into one line per issue
+MERGED_ACTIONS = ("opened", "closed", "reopened")
+# Slowest send rate, a rate of 0 would stop sending for good
+MIN_RATE = 0.1
+
+
+class EventQueue(deque[OrgEvent]):
+    """Events waiting to be reported, the oldest are dropped beyond `maxlen`."""
+
+    dropped: int
+
+    def __init__(self, maxlen: int) -> None:
+        super().__init__(maxlen=maxlen)
+        self.dropped = 0
+
+    def append(self, event: OrgEvent) -> None:
+        if len(self) == self.maxlen:
+            self.dropped += 1
+        super().append(event)
+
+    def extend(self, events: Iterable[OrgEvent]) -> None:
+        for event in events:
+            self.append(event)
+
+    def drain(self) -> tuple[list[OrgEvent], int]:
+        """Take all queued events, and the number dropped since the last drain."""
+        events, dropped = list(self), self.dropped
+        self.clear()
+        self.dropped = 0
+        return events, dropped
+
+
+def merge_key(event: OrgEvent) -> tuple:
+    match event:
+        case PushEvent(payload=payload) if payload.ref.startswith("refs/heads/"):
+            return "push", event.repo.name, payload.ref
+        case IssuesEvent(payload=payload) if payload.action in MERGED_ACTIONS:
+            return "issue", event.repo.name, payload.issue.number
+        case PullRequestEvent(payload=payload) if payload.action in MERGED_ACTIONS:
+            return "PR", event.repo.name, payload.pull_request.number
+    return "single", event.id
+
+
+def format_pushes(events: list[PushEvent]) -> str:
+    repo = events[0].repo.name
+    branch = events[0].payload.ref.removeprefix("refs/heads/")
+    actors = ", ".join(dict.fromkeys(e.actor.login for e in events))
+    sizes = [e.payload.distinct_size for e in events]
+    pushed = "pushed" if None in sizes else f"pushed {sum(sizes)} commits"
+    before, head = events[0].payload.before, events[-1].payload.head
+    return (
+        f"{actors} {pushed} to {repo} on branch {branch}\n"
+        f"https://github.com/{repo}/compare/{before[:10]}..{head[:10]}"
+    )
+
+
+def format_actions(kind: str, events: list[IssuesEvent | PullRequestEvent]) -> str:
+    last = events[-1]
+    repo = last.repo.name
+    if isinstance(last, IssuesEvent):
+        target = last.payload.issue
+        html_url = target.html_url
+    else:
+        target = last.payload.pull_request
+        html_url = pull_request_url(repo, target)
+    actions = ", ".join(f"{e.actor.login} {e.payload.action}" for e in events)
+    heading = f"{repo}#{target.number}"
+    if target.title:
+        heading += f": {target.title}"
+    return f"{actions} {kind}\n{heading}\n{html_url}"
+
+
+def digest(events: list[OrgEvent]) -> list[str]:
+    """Format `events`, merging pushes to one branch and actions on one issue or PR."""
+    related: dict[tuple, list] = {}
+    for event in events:
+        related.setdefault(merge_key(event), []).append(event)
+    parts: list[str] = []
+    for (kind, *_), merged in related.items():
+        if len(merged) == 1:
+            if formatted := format_event(merged[0]):
+                parts.append(formatted)
+        elif kind == "push":
+            parts.append(format_pushes(merged))
+        else:
+            parts.append(format_actions(kind, merged))
+    return parts
+
+
+class SendLimiter:
+    """Limits sends to `concurrency` at once, started at most `rate` per second."""
+
+    def __init__(self, concurrency: int, rate: float) -> None:
+        self.slots = asyncio.Semaphore(max(concurrency, 1))
+        self.spacing = 1 / max(rate, MIN_RATE)
+        self.next_send = 0.0
+
+    async def run(self, send: Awaitable[object]) -> None:
+        async with self.slots:
+            now = time.monotonic()
+            start = max(now, self.next_send)
+            self.next_send = start + self.spacing
+            if start > now:
+                await asyncio.sleep(start - now)
+            await send
+
+
+class Notifier:
+    """Collects org events over a window, and sends them as one digest per group."""
+
+    pending: EventQueue
+
+    def __init__(self, max_pending: int) -> None:
+        self.pending = EventQueue(max_pending)
+        self.dropped = 0  # Dropped by the per-org queues
+        self.since = 0.0  # When the oldest pending event was collected
+
+    def collect(self, queues: Iterable[EventQueue]) -> None:
+        for queue in queues:
+            events, dropped = queue.drain()
+            if dropped:
+                logger.warning(f"Dropped {dropped} org events, the queue was full")
+            if (events or dropped) and not self.has_pending:
+                self.since = time.monotonic()
+            self.pending.extend(events)
+            self.dropped += dropped
+
+    @property
+    def has_pending(self) -> bool:
+        return bool(self.pending or self.pending.dropped or self.dropped)
+
+    def due(self, window: float) -> bool:
+        return self.has_pending and time.monotonic() - self.since >= window
+
+    async def flush(
+        self,
+        groups: list[int],
+        send: Callable[[int, str], Awaitable[object]],
+        limiter: SendLimiter,
+    ) -> None:
+        events, overflow = self.pending.drain()
+        if overflow:
+            logger.warning(f"Dropped {overflow} org events, the digest was full")
+        dropped, self.dropped = self.dropped + overflow, 0
+        parts = digest(events)
+        if dropped:
+            parts.append(f"{dropped} more events were dropped while sending stalled")
+        if not parts:
+            return
+        message = "\n\n".join(parts)
+        results = await asyncio.gather(
+            *(limiter.run(send(g, message)) for g in groups), return_exceptions=True
+        )
+        for g, result in zip(groups, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send org events to group {g}: {result!r}")
@@ -0,0 +1,309 @@
+import asyncio
+import time
+from collections import deque
+from datetime import datetime, timezone
+from operator import attrgetter
+from pathlib import Path
+
+import msgspec
+from githubkit import GitHub
+from githubkit.exception import GitHubException, RequestFailed
+from githubkit.response import Response
+from httpx import Headers
+from loguru import logger
+
+from .events import EventHead, OrgEvent, decode_events
+
+# Report the rate limit at most this often, in seconds
+REPORT_INTERVAL = 600
+PER_PAGE = 100
+# The events API serves at most 300 events
+MAX_PAGES = 3
+# Event ids remembered per target, to drop repeats
+SEEN_SIZE = 500
+
+
+class RateBudget:
+    """Rate limit of the token, as reported by the latest response."""
+
+    def __init__(self, reserve: int) -> None:
+        self.reserve = reserve
+        self.limit = 5000
+        self.remaining = 5000
+        self.reset = 0.0  # Unix timestamp
+
+    def update(self, headers: Headers) -> None:
+        if "X-RateLimit-Remaining" not in headers:
+            return
+        self.limit = int(headers.get("X-RateLimit-Limit", self.limit))
+        self.remaining = int(headers["X-RateLimit-Remaining"])
+        self.reset = float(headers.get("X-RateLimit-Reset", self.reset))
+
+    @property
+    def resets_in(self) -> float:
+        return max(self.reset - time.time(), 0)
+
+    def spacing(self) -> float:
+        """Seconds between polls that spread the spare budget until the reset."""
+        spare = self.remaining - self.reserve
+        if spare <= 0:
+            return self.resets_in
+        return self.resets_in / spare
+
+    def __str__(self) -> str:
+        return f"{self.remaining}/{self.limit}, resets in {self.resets_in:.0f}s"
+
+
+class Cursor(msgspec.Struct):
+    """Where polling of a target left off, kept across restarts."""
+
+    etag: str | None = None
+    last_id: int = 0
+    updated: datetime | None = None
+    seen: list[int] = []
+
+
+class PollTarget:
+    name: str
+    path: str
+    events: deque[OrgEvent]
+    cursor: Cursor
+    seen: deque[int]
+    interval: float
+    next_poll: float
+    errors: int
+    handed_over: bool
+    last_delivery: float
+
+    def __init__(
+        self, name: str, path: str, events: deque[OrgEvent], cursor: Cursor
+    ) -> None:
+        self.name = name
+        self.path = path
+        self.events = events
+        self.cursor = cursor
+        self.seen = deque(cursor.seen, maxlen=SEEN_SIZE)
+        self.seen_set = set(self.seen)
+        self.interval = 0
+        self.next_poll = 0
+        self.errors = 0
+        self.handed_over = False
+        self.last_delivery = 0
+
+    @property
+    def floor(self) -> int:
+        """Events with ids up to this one are older than anything remembered."""
+        return min(self.seen, default=0)
+
+    def overlaps(self, events: list[EventHead]) -> bool:
+        return any(
+            int(e.id) in self.seen_set or int(e.id) <= self.floor for e in events
+        )
+
+    def accept(self, events: list[EventHead]) -> list[EventHead]:
+        """Remember `events`, returning the ones not reported before, oldest first."""
+        fresh = self.cursor.updated is None
+        new = sorted(
+            (
+                e
+                for e in events
+                if int(e.id) not in self.seen_set and int(e.id) > self.floor
+            ),
+            key=lambda e: int(e.id),
+        )
+        for e in new:
+            if len(self.seen) == self.seen.maxlen:
+                self.seen_set.discard(self.seen[0])
+            self.seen.append(int(e.id))
+            self.seen_set.add(int(e.id))
+        self.cursor.seen = list(self.seen)
+        self.cursor.last_id = max(self.seen, default=0)
+        # Events from before the first poll are history, not news
+        return [] if fresh else new
+
+
+class PollScheduler:
+    """Polls the events of all targets in turn, sharing one token's rate limit.
+
+    Targets that stay quiet are polled less and less often, up to `max_interval`,
+    and the gap between any two polls is stretched so the budget left above `reserve`
+    lasts until the rate limit resets. Targets handed over to webhooks are polled
+    again once no delivery has arrived for `stale_after` seconds.
+    """
+
+    targets: dict[str, PollTarget]
+    handed_over: dict[str, PollTarget]
+
+    def __init__(
+        self,
+        gh: GitHub,
+        store: Path,
+        min_interval: float,
+        max_interval: float,
+        reserve: int,
+        stale_after: float,
+    ) -> None:
+        self.gh = gh
+        self.store = store
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stale_after = stale_after
+        self.budget = RateBudget(reserve)
+        self.targets = {}
+        self.handed_over = {}
+        self.last_request = 0.0
+        self.last_report = 0.0
+        self.cursors: dict[str, Cursor] = {}
+        if store.exists():
+            try:
+                self.cursors = msgspec.msgpack.decode(
+                    store.read_bytes(), type=dict[str, Cursor]
+                )
+            except msgspec.DecodeError:
+                logger.warning("Poll cursors are corrupted, starting over")
+
+    def add_org(self, org: str, events: deque[OrgEvent]) -> None:
+        cursor = self.cursors.setdefault(org, Cursor())
+        self.targets[org] = PollTarget(org, f"/orgs/{org}/events", events, cursor)
+
+    def hand_over(self, org: str) -> None:
+        """Stop polling `org`, its events are delivered by webhook now."""
+        if (target := self.handed_over.get(org)) is not None:
+            target.last_delivery = time.monotonic()
+            return
+        if (target := self.targets.pop(org, None)) is None:
+            return
+        # A poll already in flight checks this, and drops what it fetched
+        target.handed_over = True
+        target.last_delivery = time.monotonic()
+        self.handed_over[org] = target
+        # Polling starts afresh after a restart, instead of repeating what webhooks
+        # delivered since this cursor was last updated
+        target.cursor.etag = None
+        target.cursor.updated = None
+        self.save()
+        logger.info(f"Receiving events of {org} by webhook, polling stopped")
+
+    def resume_stale(self) -> None:
+        """Poll again the targets that have not had a webhook delivery for a while."""
+        now = time.monotonic()
+        for org, target in list(self.handed_over.items()):
+            if now - target.last_delivery < self.stale_after:
+                continue
+            del self.handed_over[org]
+            target.handed_over = False
+            target.interval = 0
+            target.next_poll = 0
+            target.errors = 0
+            self.targets[org] = target
+            logger.warning(
+                f"No webhook delivery of {org} for {self.stale_after:.0f}s,"
+                " polling again"
+            )
+
+    def save(self) -> None:
+        tmp = self.store.with_suffix(".tmp")
+        tmp.write_bytes(msgspec.msgpack.encode(self.cursors))
+        tmp.replace(self.store)
+
+    async def fetch(
+        self, target: PollTarget, page: int, headers: dict[str, str]
+    ) -> Response:
+        resp = await self.gh.arequest(
+            "GET",
+            target.path,
+            params={"per_page": PER_PAGE, "page": page},
+            headers=headers,
+        )
+        self.budget.update(resp.headers)
+        return resp
+
+    async def poll(self, target: PollTarget) -> None:
+        cursor = target.cursor
+        headers = {"If-None-Match": cursor.etag} if cursor.etag else {}
+        try:
+            resp = await self.fetch(target, 1, headers)
+            events = decode_events(resp.content) if resp.status_code == 200 else []
+            # Catch up on older pages until they reach events reported before
+            page = 1
+            while (
+                len(events) == PER_PAGE * page
+                and page < MAX_PAGES
+                and cursor.updated is not None
+                and not target.overlaps(events)
+            ):
+                page += 1
+                events.extend(
+                    decode_events((await self.fetch(target, page, {})).content)
+                )
+        except (GitHubException, msgspec.DecodeError) as e:
+            if target.handed_over:
+                return
+            if isinstance(e, RequestFailed):
+                self.budget.update(e.response.headers)
+            target.errors += 1
+            delay = min(self.min_interval * 2**target.errors, self.max_interval)
+            if isinstance(e, RequestFailed) and e.response.status_code in (403, 429):
+                retry_after = e.response.headers.get("Retry-After")
+                limited = float(retry_after) if retry_after else self.budget.resets_in
+                delay = max(delay, limited)
+            logger.error(
+                f"Error polling {target.name}: {e!r}, retrying in {delay:.0f}s"
+            )
+            target.next_poll = time.monotonic() + delay
+            return
+
+        if target.handed_over:  # Webhooks took over while this poll was in flight
+            return
+        base = max(float(resp.headers.get("X-Poll-Interval", 60)), self.min_interval)
+        new: list[OrgEvent] = []
+        if resp.status_code == 200:  # New event arrived
+            # Only ids of unhandled types are decoded, they are just remembered
+            new = [e for e in target.accept(events) if isinstance(e, OrgEvent)]
+            target.events.extend(new)
+            cursor.etag = resp.headers.get("ETag")
+        cursor.updated = datetime.now(timezone.utc)
+        self.save()
+        target.errors = 0
+        # Back to the fastest interval on activity, slow down while quiet
+        target.interval = (
+            base if new else min(max(target.interval, base) * 1.5, self.max_interval)
+        )
+        target.next_poll = time.monotonic() + target.interval
+        logger.debug(
+            f"Polled {target.name}: {len(new)} new events,"
+            f" next in {target.interval:.0f}s, rate limit {self.budget}"
+        )
+
+    def report(self) -> None:
+        level = "WARNING" if self.budget.remaining <= self.budget.reserve else "INFO"
+        logger.log(level, f"GitHub rate limit: {self.budget}")
+        self.last_report = time.monotonic()
+
+    async def run(self) -> None:
+        while self.targets or self.handed_over:
+            self.resume_stale()
+            if not self.targets:
+                stale = min(t.last_delivery for t in self.handed_over.values())
+                await asyncio.sleep(max(stale + self.stale_after - time.monotonic(), 0))
+                continue
+            target = min(self.targets.values(), key=attrgetter("next_poll"))
+            now = time.monotonic()
+            ready = max(target.next_poll, self.last_request + self.budget.spacing())
+            if ready > now:
+                await asyncio.sleep(ready - now)
+            if target.handed_over:  # Handed over while waiting
+                continue
+            self.last_request = time.monotonic()
+            try:
+                await self.poll(target)
+            except Exception:
+                # Keep polling the other targets, like the per-org pollers did
+                target.errors += 1
+                delay = min(self.min_interval * 2**target.errors, self.max_interval)
+                logger.exception(
+                    f"Unexpected error polling {target.name}, retrying in {delay:.0f}s"
+                )
+                target.next_poll = time.monotonic() + delay
+            if time.monotonic() - self.last_report > REPORT_INTERVAL:
+                self.report()
@@ -1,29 +1,38 @@
-from githubkit.rest.models import Event
+import asyncio
 
-from library.render import get_page
+import msgspec
+from graia.amnesia.builtins.aiohttp import AiohttpClientInterface
 
+from library.render import (
+    DEFAULT_PROFILE,
+    Priority,
+    RenderCache,
+    get_cache,
+    get_page,
+    postprocess,
+)
 
-async def link_to_image(gh_link: str) -> bytes:
-    async with get_page() as page:
-        await page.goto(gh_link, timeout=80000, wait_until="networkidle")
-        await page.evaluate(
-            """
-            var need_remove_cls = ['Layout-sidebar', 'js-header-wrapper', 'footer', 'gh-header-actions', 'discussion-timeline-actions', 'js-repo-nav', 'tabnav'];
-            need_remove_cls.forEach( val => {
-                var elem_arr = document.getElementsByClassName(val);
-                    if (elem_arr.length){
-                        elem_arr[0].remove();
-                    }
-                }
-            );
-            document.getElementsByClassName('Layout--flowRow-until-md')[0].classList.remove('Layout');
-            """
-        )
-        return await page.screenshot(full_page=True)
+from .events import (
+    IssuesEvent,
+    OrgEvent,
+    PullRequest,
+    PullRequestEvent,
+    PullRequestReviewEvent,
+    PushEvent,
+    ReleaseEvent,
+)
 
+PROFILE = DEFAULT_PROFILE.extend(
+    frozenset({"font"}),
+    (
+        r"^https://collector\.github\.com/",
+        r"^https://api\.github\.com/_private/browser/",
+    ),
+)
 
-async def files_changed_image(gh_link: str) -> list[bytes]:
-    async with get_page() as page:
+
+async def screenshot_files_changed(gh_link: str) -> list[bytes]:
+    async with get_page(gh_link, Priority.LOW, PROFILE) as page:
         await page.goto(gh_link, timeout=80000, wait_until="networkidle")
         await page.evaluate(
             """
@@ -38,64 +47,95 @@ async def files_changed_image(gh_link: str) -> list[bytes]:
             document.getElementsByClassName('Layout--flowRow-until-md')[0].classList.remove('Layout');
             """
         )
-        return [
+        shots = [
             await elem.screenshot() for elem in await page.query_selector_all(".file")
         ]
+    return list(await asyncio.gather(*map(postprocess, shots)))
 
 
-def format_event(event: Event) -> str | None:
+async def open_graph_image(
+    client: AiohttpClientInterface, full_name: str, state: str
+) -> bytes:
+    """OpenGraph card of `full_name`, only downloaded again once `state` changes."""
+    key = RenderCache.key(f"https://github.com/{full_name}", f"opengraph {state}")
+
+    async def fetch() -> bytes:
+        # The first path segment only busts caches, the same one is reused until the
+        # repo changes
+        io = (
+            await client.request(
+                "get", f"https://opengraph.githubassets.com/{key[:16]}/{full_name}"
+            )
+        ).io()
+        io.response.raise_for_status()
+        return await io.read()
+
+    return await get_cache().fetch("opengraph", key, fetch)
+
+
+async def files_changed_image(gh_link: str) -> list[bytes]:
+    async def render() -> bytes:
+        return msgspec.msgpack.encode(await screenshot_files_changed(gh_link))
+
+    data = await get_cache().fetch("github", RenderCache.key(gh_link, ".file"), render)
+    return msgspec.msgpack.decode(data, type=list[bytes])
+
+
+def pull_request_url(repo: str, pull_request: PullRequest) -> str:
+    return (
+        pull_request.html_url or f"https://github.com/{repo}/pull/{pull_request.number}"
+    )
+
+
+def format_event(event: OrgEvent) -> str | None:
     actor = event.actor.login
     repo = event.repo.name
-    payload = event.payload.dict()
-    match event.type:
-        case "PushEvent":
-            ref_full: str = payload["ref"]
+    match event:
+        case PushEvent(payload=payload):
+            ref_full = payload.ref
             if (branch := ref_full.removeprefix("refs/heads/")) == ref_full:
                 return
-            size: int = payload["distinct_size"]
+            size = payload.distinct_size
             if size == 1:
                 return (
-                    f'{actor} pushed {payload["head"][:7]} to {repo} on branch {branch}\n'
-                    f'https://github.com/{repo}/commit/{payload["head"]}'
+                    f"{actor} pushed {payload.head[:7]} to {repo} on branch {branch}\n"
+                    f"https://github.com/{repo}/commit/{payload.head}"
                 )
             else:
+                pushed = "pushed" if size is None else f"pushed {size} commits"
                 return (
-                    f"{actor} pushed {size} commits to {repo} on branch {branch}\n"
-                    f'https://github.com/{repo}/compare/{payload["before"][:10]}..{payload["head"][:10]}'
+                    f"{actor} {pushed} to {repo} on branch {branch}\n"
+                    f"https://github.com/{repo}/compare/{payload.before[:10]}..{payload.head[:10]}"
                 )
-        case "ReleaseEvent":
-            if payload["action"] == "created" and payload["release"]["draft"] == False:
+        case ReleaseEvent(payload=payload):
+            if payload.action == "created" and not payload.release.draft:
                 return (
-                    f'{actor} released {payload["release"]["name"]} on {repo}\n'
-                    f'{payload["release"]["url"]}'
+                    f"{actor} released {payload.release.name} on {repo}\n"
+                    f"{payload.release.url}"
                 )
-        case "IssuesEvent":
-            if payload["action"] not in ("opened", "closed", "reopened"):
+        case IssuesEvent(payload=payload):
+            if payload.action not in ("opened", "closed", "reopened"):
                 return
-            title = payload["issue"]["title"]
-            number = payload["issue"]["number"]
+            title = payload.issue.title
+            number = payload.issue.number
             return (
-                f'{actor} {payload["action"]} issue\n'
+                f"{actor} {payload.action} issue\n"
                 f"{repo}#{number}: {title}\n"
-                f'{payload["issue"]["html_url"]}'
+                f"{payload.issue.html_url}"
             )
-        case "PullRequestEvent":
-            title = payload["pull_request"]["title"]
-            number = payload["pull_request"]["number"]
-            if payload["action"] in ("opened", "closed", "reopened"):
-                return (
-                    f'{actor} {payload["action"]} PR\n'
-                    f"{repo}#{number}: {title}\n"
-                    f'{payload["pull_request"]["html_url"]}'
-                )
-            elif payload["action"] == "review_requested":
-                return (
-                    f"{actor} requested an review on {repo}#{number}\n"
-                    f'{payload["pull_request"]["html_url"]}'
-                )
-        case "PullRequestReviewEvent":
-            number = payload["pull_request"]["number"]
-            return (
-                f"{actor} {payload['review']['state'].lower()} {repo}#{number}\n"
-                f'{payload["review"]["html_url"]}'
+        case PullRequestEvent(payload=payload):
+            number = payload.pull_request.number
+            heading = f"{repo}#{number}"
+            if payload.pull_request.title:
+                heading += f": {payload.pull_request.title}"
+            html_url = pull_request_url(repo, payload.pull_request)
+            if payload.action in ("opened", "closed", "reopened"):
+                return f"{actor} {payload.action} PR\n{heading}\n{html_url}"
+            elif payload.action == "review_requested":
+                return f"{actor} requested an review on {repo}#{number}\n{html_url}"
+        case PullRequestReviewEvent(payload=payload):
+            number = payload.pull_request.number
+            html_url = payload.review.html_url or pull_request_url(
+                repo, payload.pull_request
             )
+            return f"{actor} {payload.review.state.lower()} {repo}#{number}\n{html_url}"
@@ -1,21 +1,25 @@
 import asyncio
 import contextlib
-import datetime as dt_mod
+import time
 from asyncio import Task
-from collections import deque
-from datetime import datetime, timedelta
-from operator import attrgetter
+from collections.abc import Iterator
 
+import httpx
 from githubkit import GitHub as BaseGitHub
 from githubkit import TokenAuthStrategy
-from githubkit.exception import GitHubException
-from githubkit.rest.models import Event
 from graia.saya import Channel
 from kayaku import create
 from launart import ExportInterface, Service
 from launart.saya import LaunchableSchema
 from loguru import logger
 
+from library.storage import dir
+
+from .cache import ResponseCache, caching
+from .notify import EventQueue
+from .poll import PollScheduler
+from .webhook import WebhookReceiver
+
 channel = Channel.current()
 
 
@@ -23,17 +27,55 @@ class GitHub(BaseGitHub[TokenAuthStrategy], ExportInterface):
     def __init__(
         self,
         auth: TokenAuthStrategy,
-        polls: dict[str, deque[Event]] | None = None,
+        polls: dict[str, EventQueue] | None = None,
     ):
         super().__init__(auth)
-        self.polls: dict[str, deque[Event]] = polls if polls is not None else {}
+        self.polls: dict[str, EventQueue] = polls if polls is not None else {}
+        self.scheduler: PollScheduler | None = None
+        self.cache: ResponseCache | None = None
+
+    @contextlib.contextmanager
+    def cached(self) -> Iterator[None]:
+        """Serve GET requests made inside from `cache`, revalidating stale entries."""
+        token = caching.set(True)
+        try:
+            yield
+        finally:
+            caching.reset(token)
+
+    async def _arequest(self, method, url, *, params=None, headers=None, **kwargs):
+        if method != "GET" or self.cache is None or not caching.get():
+            return await super()._arequest(
+                method, url, params=params, headers=headers, **kwargs
+            )
+        request = httpx.Request(method, self.config.base_url.join(url), params=params)
+        key = self.cache.key(request)
+        entry = self.cache.get(key)
+        if entry is not None and self.cache.fresh(entry):
+            self.cache.hits += 1
+            return entry.response(request)
+        conditional = dict(headers or {})
+        if entry is not None:
+            conditional.update(entry.validators)
+        resp = await super()._arequest(
+            method, url, params=params, headers=conditional, **kwargs
+        )
+        if resp.status_code == 304 and entry is not None:
+            self.cache.revalidated += 1
+            entry.stored = time.time()
+            return entry.response(resp.request)
+        self.cache.misses += 1
+        if resp.status_code == 200:
+            self.cache.put(key, resp)
+        return resp
 
 
 class GitHubService(Service):
     id = "service.github"
     instance: GitHub
-    polls: dict[str, deque[Event]]
-    tasks: set[Task]
+    polls: dict[str, EventQueue]
+    poll_task: Task | None = None
+    receiver: WebhookReceiver | None = None
     supported_interface_types = {GitHub}
 
     @property
@@ -47,42 +89,9 @@ class GitHubService(Service):
     def get_interface(self, _: type[GitHub]) -> GitHub:
         return self.instance
 
-    @logger.catch
-    async def poll_org(self, org: str, update_deque: deque[Event]) -> None:
-        last_poll = datetime.now(tz=dt_mod.timezone(timedelta(hours=8)))  # UTC+8
-        inst = GitHub(self.instance.auth)
-        poll_func = inst.rest.activity.async_list_public_org_events
-        async with inst:
-            async with inst.get_async_client() as client:
-                while True:
-                    try:
-                        resp = await poll_func(org)
-                        if resp.status_code == 200:  # New event arrived
-                            update_deque.extend(
-                                sorted(
-                                    (
-                                        e
-                                        for e in resp.parsed_data
-                                        if e.created_at and e.created_at > last_poll
-                                    ),
-                                    key=attrgetter("created_at"),
-                                )
-                            )
-                        if resp.status_code in (200, 304):
-                            client.headers["If-None-Match"] = resp.headers["ETag"]
-                            last_poll = datetime.now(
-                                tz=dt_mod.timezone(timedelta(hours=8))  # UTC+8
-                            )
-                        await asyncio.sleep(
-                            float(resp.headers.get("X-Poll-Interval", 30))
-                        )
-                    except GitHubException as e:
-                        logger.error(f"Error polling {org}: {e!r}")
-
     async def launch(self, _):
         self.polls = {}
-        self.tasks = set()
-        from . import MasterCredential, OrgMonitor
+        from . import ApiCache, MasterCredential, OrgMonitor, OrgWebhook
 
         async with self.stage("preparing"):
             credential = create(MasterCredential)
@@ -91,17 +100,50 @@ class GitHubService(Service):
             )
             logger.info(f"Using auth strategy: {self.instance.auth.__class__.__name__}")
             await self.instance.__aenter__()
+            api_cache = create(ApiCache)
+            self.instance.cache = ResponseCache(
+                api_cache.ttl,
+                api_cache.size,
+                dir("github") / "responses.msgpack" if api_cache.persist else None,
+            )
             org_monitor = create(OrgMonitor)
+            webhook = create(OrgWebhook)
+            scheduler = PollScheduler(
+                self.instance,
+                dir("github") / "cursors.msgpack",
+                org_monitor.min_interval,
+                org_monitor.max_interval,
+                org_monitor.reserve,
+                webhook.stale_after,
+            )
             for org in org_monitor.orgs:
-                self.polls[org] = deque()
-                self.tasks.add(asyncio.create_task(self.poll_org(org, self.polls[org])))
-                logger.info(f"Starting poll task for organization {org}")
+                self.polls[org] = EventQueue(org_monitor.queue_size)
+                scheduler.add_org(org, self.polls[org])
+                logger.info(f"Polling events of organization {org}")
+            self.instance.scheduler = scheduler
+            if webhook.enabled and not webhook.secret:
+                logger.error("Webhook is enabled without a secret, only polling")
+            elif webhook.enabled:
+                self.receiver = WebhookReceiver(
+                    webhook.secret, webhook.path, self.polls, scheduler.hand_over
+                )
+                await self.receiver.start(webhook.host, webhook.port)
+                logger.info(
+                    f"Receiving webhooks on http://{webhook.host}:{webhook.port}"
+                    f"{webhook.path}"
+                )
+            self.poll_task = asyncio.create_task(scheduler.run())
 
         async with self.stage("cleanup"):
-            for task in self.tasks:
-                task.cancel()
+            if self.receiver:
+                await self.receiver.stop()
+            if self.poll_task:
+                self.poll_task.cancel()
                 with contextlib.suppress(asyncio.CancelledError):
-                    await task
+                    await self.poll_task
+            if self.instance.cache:
+                logger.info(f"GitHub response cache: {self.instance.cache}")
+                self.instance.cache.save()
             await self.instance.__aexit__()
 
 
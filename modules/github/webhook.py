@@ -0,0 +1,168 @@
+import hashlib
+import hmac
+from collections import deque
+from collections.abc import Callable
+from datetime import datetime, timezone
+
+import msgspec
+from aiohttp import web
+from loguru import logger
+
+from .events import (
+    Actor,
+    IssuesEvent,
+    IssuesPayload,
+    OrgEvent,
+    PullRequestEvent,
+    PullRequestPayload,
+    PullRequestReviewEvent,
+    PullRequestReviewPayload,
+    PushEvent,
+    PushPayload,
+    ReleaseEvent,
+    ReleasePayload,
+    Repo,
+)
+
+# Delivery ids remembered, to drop redeliveries
+SEEN_SIZE = 500
+
+
+class Repository(msgspec.Struct):
+    full_name: str
+
+
+class Delivery(msgspec.Struct):
+    """Fields shared by the webhook payloads of all handled events."""
+
+    sender: Actor
+    repository: Repository | None = None
+    organization: Actor | None = None
+
+
+class Commit(msgspec.Struct):
+    distinct: bool
+
+
+class PushDelivery(msgspec.Struct):
+    ref: str
+    before: str
+    after: str
+    commits: list[Commit] = []
+
+
+def push_payload(data: bytes) -> PushPayload:
+    # Webhooks list the commits instead of counting the distinct ones
+    push = msgspec.json.decode(data, type=PushDelivery)
+    return PushPayload(
+        push.ref, push.after, push.before, sum(c.distinct for c in push.commits)
+    )
+
+
+# Webhook event name -> (event struct, payload decoder)
+EVENTS: dict[str, tuple[type[OrgEvent], Callable[[bytes], object]]] = {
+    "push": (PushEvent, push_payload),
+    "release": (ReleaseEvent, msgspec.json.Decoder(ReleasePayload).decode),
+    "issues": (IssuesEvent, msgspec.json.Decoder(IssuesPayload).decode),
+    "pull_request": (PullRequestEvent, msgspec.json.Decoder(PullRequestPayload).decode),
+    "pull_request_review": (
+        PullRequestReviewEvent,
+        msgspec.json.Decoder(PullRequestReviewPayload).decode,
+    ),
+}
+delivery_decoder = msgspec.json.Decoder(Delivery)
+
+
+def verify(secret: bytes, body: bytes, signature: str | None) -> bool:
+    if not signature or not signature.startswith("sha256="):
+        return False
+    expected = hmac.new(secret, body, hashlib.sha256).hexdigest()
+    return hmac.compare_digest(expected, signature.removeprefix("sha256="))
+
+
+def normalize(name: str, delivery_id: str, body: bytes) -> tuple[str, OrgEvent | None]:
+    """The organization a delivery belongs to, and its event if it is a handled one.
+
+    Webhook payloads are shaped differently from the events API, they are turned into
+    the same structs `format_event` takes from polling.
+    """
+    delivery = delivery_decoder.decode(body)
+    if delivery.organization is not None:
+        org = delivery.organization.login
+    elif delivery.repository is not None:
+        org = delivery.repository.full_name.partition("/")[0]
+    else:
+        org = ""
+    if (handled := EVENTS.get(name)) is None or delivery.repository is None:
+        return org, None
+    cls, decode_payload = handled
+    event = cls(
+        id=delivery_id,
+        type=cls.__name__,
+        actor=delivery.sender,
+        repo=Repo(delivery.repository.full_name),
+        created_at=datetime.now(timezone.utc),
+        payload=decode_payload(body),
+    )
+    return org, event
+
+
+class WebhookReceiver:
+    """Receives GitHub webhook deliveries for the monitored organizations.
+
+    Deliveries are checked against `X-Hub-Signature-256` and go into the same queues
+    as polled events. Only hooks of whole organizations are handled, a repository hook
+    covers part of an org that is still polled. `on_delivery` is called with the
+    organization of every verified event, so polling of it can stop.
+    """
+
+    polls: dict[str, deque[OrgEvent]]
+
+    def __init__(
+        self,
+        secret: str,
+        path: str,
+        polls: dict[str, deque[OrgEvent]],
+        on_delivery: Callable[[str], None],
+    ) -> None:
+        self.secret = secret.encode()
+        self.polls = polls
+        self.on_delivery = on_delivery
+        self.seen: deque[str] = deque(maxlen=SEEN_SIZE)
+        self.app = web.Application()
+        self.app.router.add_post(path, self.handle)
+        self.runner: web.AppRunner | None = None
+
+    async def start(self, host: str, port: int) -> None:
+        self.runner = web.AppRunner(self.app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, host, port).start()
+
+    async def stop(self) -> None:
+        if self.runner:
+            await self.runner.cleanup()
+
+    async def handle(self, request: web.Request) -> web.Response:
+        body = await request.read()
+        if not verify(self.secret, body, request.headers.get("X-Hub-Signature-256")):
+            return web.Response(status=401, text="Bad signature")
+        name = request.headers.get("X-GitHub-Event", "")
+        delivery_id = request.headers.get("X-GitHub-Delivery", "")
+        try:
+            org, event = normalize(name, delivery_id, body)
+        except msgspec.DecodeError as e:
+            logger.warning(f"Malformed {name} webhook delivery {delivery_id}: {e}")
+            return web.Response(status=400, text="Malformed payload")
+        if org not in self.polls:
+            return web.Response(status=202, text="Not monitored")
+        target_type = request.headers.get("X-GitHub-Hook-Installation-Target-Type")
+        if target_type != "organization":
+            return web.Response(status=202, text="Not an organization hook")
+        if name != "ping":  # Sent once when the hook is created, it proves nothing
+            self.on_delivery(org)
+        if event is None or (delivery_id and delivery_id in self.seen):
+            return web.Response(status=202, text="Ignored")
+        if delivery_id:
+            self.seen.append(delivery_id)
+        self.polls[org].append(event)
+        return web.Response(status=202, text="Accepted")
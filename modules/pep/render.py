@@ -1,12 +1,25 @@
-from library.render import get_page
+from library.render import (
+    DEFAULT_PROFILE,
+    Priority,
+    RenderCache,
+    get_cache,
+    get_page,
+    postprocess,
+)
 
+PROFILE = DEFAULT_PROFILE.extend(frozenset({"font"}))
 
-async def PEP_to_image(pep: int) -> bytes:
-    async with get_page() as page:
-        await page.goto(
-            f"https://peps.python.org/pep-{pep}/",
-            timeout=5000,
-            wait_until="networkidle",
-        )
+
+async def render_pep(url: str) -> bytes:
+    async with get_page(url, Priority.HIGH, PROFILE) as page:
+        await page.goto(url, timeout=5000, wait_until="networkidle")
         await page.locator("details").evaluate("node => node.open = true")
-        return await page.locator("article").screenshot()
+        shot = await page.locator("article").screenshot()
+    return await postprocess(shot)
+
+
+async def PEP_to_image(pep: int) -> bytes:
+    url = f"https://peps.python.org/pep-{pep}/"
+    return await get_cache().fetch(
+        "pep", RenderCache.key(url, "article"), lambda: render_pep(url)
+    )
@@ -0,0 +1,46 @@
+"""Post recorded GitHub webhook payloads to the local webhook receiver.
+
+Payloads are signed with the configured secret, like GitHub would. The event name is
+taken from `--event`, or from the file name up to the first dot (`push.json`,
+`pull_request.2.json`):
+
+    pdm run python scripts/replay_webhook.py --secret s3cret push.json issues.json
+"""
+
+import argparse
+import hashlib
+import hmac
+import uuid
+from pathlib import Path
+
+import httpx
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("payloads", type=Path, nargs="+")
+    parser.add_argument("--secret", required=True)
+    parser.add_argument("--event", help="event name of all payloads")
+    parser.add_argument("--url", default="http://127.0.0.1:8765/github/webhook")
+    args = parser.parse_args()
+
+    with httpx.Client() as client:
+        for path in args.payloads:
+            body = path.read_bytes()
+            signature = hmac.new(args.secret.encode(), body, hashlib.sha256)
+            resp = client.post(
+                args.url,
+                content=body,
+                headers={
+                    "Content-Type": "application/json",
+                    "X-GitHub-Event": args.event or path.name.partition(".")[0],
+                    "X-GitHub-Delivery": str(uuid.uuid4()),
+                    "X-GitHub-Hook-Installation-Target-Type": "organization",
+                    "X-Hub-Signature-256": f"sha256={signature.hexdigest()}",
+                },
+            )
+            print(f"{path}: {resp.status_code} {resp.text}")
+
+
+if __name__ == "__main__":
+    main()